@@ -0,0 +1,20 @@
+"""Compares coarse-to-fine segmentation with full resolution `get_stomata` on sparse and dense synthetic images,
+on zero backgrounds and on clipped noisy backgrounds, where coarse-to-fine should fall back to full resolution
+
+    python benchmarks/bench_coarse_to_fine.py
+
+"""
+
+from stomatadetector.stomataobjects import validate_coarse_to_fine
+from synthetic import synthetic_leaf, speckled_leaf
+
+
+if __name__ == '__main__':
+    print("background stomata bin   dice     f1  full_s  coarse_s  speedup")
+    for background, make_leaf, size in (('zero', synthetic_leaf, 4096), ('speckled', speckled_leaf, 2048)):
+        for n_stomata in (50, 400, 1500):
+            img = make_leaf(size=size, n_stomata=n_stomata)
+            for bin_factor in (2, 4, 8):
+                r = validate_coarse_to_fine(img, bin_factor=bin_factor)
+                print("{:>10s} {:8d} {:3d} {:6.3f} {:6.3f} {:7.2f} {:9.2f} {:7.1f}x".format(
+                    background, n_stomata, bin_factor, r['dice'], r['f1'], r['full_seconds'], r['coarse_seconds'], r['speedup']))
@@ -0,0 +1,65 @@
+"""Compares the cost of returning analysed images from worker processes as pickled LeafImage's and as
+SharedLeafImage's
+
+    python benchmarks/bench_shared_memory.py [n_files]
+
+"""
+
+import os
+import pickle
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import stomatadetector as sd
+from synthetic import write_synthetic_stack, SEGMENT_OPTIONS
+
+
+def analyse(flex_file):
+    return sd.analyse_flex_file(flex_file, segment_options=SEGMENT_OPTIONS)
+
+
+def analyse_shared(flex_file):
+    return sd.analyse_flex_file_shared(flex_file, segment_options=SEGMENT_OPTIONS)
+
+
+def transfer_seconds(obj, repeats=5):
+    """time to pickle and unpickle obj, the transfer cost paid by a process pool on top of the pipe"""
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        copy = pickle.loads(pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL))
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+        if isinstance(copy, sd.SharedLeafImage):
+            copy.close()
+    return best
+
+
+if __name__ == '__main__':
+    n_files = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    with tempfile.TemporaryDirectory() as d:
+        flex_files = [write_synthetic_stack(os.path.join(d, '{}.tif'.format(i)), size=2048, n_stomata=300, seed=i)
+                      for i in range(n_files)]
+
+        leaf = analyse(flex_files[0])
+        with sd.SharedLeafImage(leaf) as shared:
+            print("pickled size   LeafImage: {:10d} bytes  SharedLeafImage: {:8d} bytes".format(
+                len(pickle.dumps(leaf, protocol=pickle.HIGHEST_PROTOCOL)),
+                len(pickle.dumps(shared, protocol=pickle.HIGHEST_PROTOCOL))))
+            print("pickle+unpickle LeafImage: {:8.4f}s  SharedLeafImage: {:8.4f}s".format(
+                transfer_seconds(leaf), transfer_seconds(shared)))
+
+        with ProcessPoolExecutor() as pool:
+            list(pool.map(analyse_shared, flex_files[:1])).pop().unlink() # start the workers
+            start = time.perf_counter()
+            results = list(pool.map(analyse, flex_files))
+            plain = time.perf_counter() - start
+            start = time.perf_counter()
+            shared_results = list(pool.map(analyse_shared, flex_files))
+            shared = time.perf_counter() - start
+        assert [r.object_count() for r in results] == [r.object_count() for r in shared_results]
+        assert all((r.mp == s.mp).all() for r, s in zip(results, shared_results))
+        for s in shared_results:
+            s.unlink()
+    print("process pool, {} files   LeafImage: {:.2f}s  SharedLeafImage: {:.2f}s".format(n_files, plain, shared))
@@ -0,0 +1,42 @@
+"""Times LeafImage construction with per-object pore extraction on 1 thread and on a thread pool, and the share of
+the serial time spent in the per-object phase, which bounds the speedup threads can give
+
+    python benchmarks/bench_threads.py [threads]
+
+"""
+
+import os
+import sys
+import tempfile
+import time
+import stomatadetector as sd
+from synthetic import write_synthetic_stack, SEGMENT_OPTIONS
+
+
+def time_leaf_image(flex_file, threads, repeats=3):
+    segment_options = sd.stomataobjects.Qopts(SEGMENT_OPTIONS + [('threads', threads)])
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        leaf = sd.LeafImage(flex_file, image_options=[], segment_options=segment_options)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, leaf
+
+
+if __name__ == '__main__':
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else os.cpu_count()
+    with tempfile.TemporaryDirectory() as d:
+        flex_file = write_synthetic_stack(os.path.join(d, 'leaf.tif'), size=4096, n_stomata=1500)
+        serial, serial_leaf = time_leaf_image(flex_file, 1)
+        threaded, threaded_leaf = time_leaf_image(flex_file, threads)
+    assert [s.stoma_info() for s in serial_leaf.stomata_objects] == [s.stoma_info() for s in threaded_leaf.stomata_objects]
+    segment_options = sd.stomataobjects.Qopts(SEGMENT_OPTIONS)
+    start = time.perf_counter()
+    for s in serial_leaf.stomata_objects:
+        sd.stomataobjects.StomataObject(serial_leaf.mp[s.position_in_image], s.position_in_image, s.props,
+                                        serial_leaf.binary_obj_img, s.label, segment_options).stoma_info()
+    per_object = time.perf_counter() - start
+    print("objects: {}".format(serial_leaf.object_count()))
+    print("per-object phase: {:.2f}s, {:.0%} of the 1 thread time".format(per_object, per_object / serial))
+    print("1 thread: {:.2f}s  {} threads: {:.2f}s  speedup: {:.2f}x".format(serial, threads, threaded, serial / threaded))
@@ -0,0 +1,45 @@
+"""Synthetic leaf images for the benchmarks: dark background with bright elliptical stomata that have a darker pore
+"""
+
+import numpy as np
+import tifffile
+
+
+def synthetic_leaf(size=2048, n_stomata=200, seed=0):
+    """returns a uint16 image of `size` x `size` with `n_stomata` stomata-like objects"""
+    rng = np.random.RandomState(seed)
+    img = np.zeros((size, size), dtype='uint16')
+    for _ in range(n_stomata):
+        cy, cx = rng.randint(30, size - 30, 2)
+        a, b = rng.uniform(12, 16), rng.uniform(8, 11)
+        yy, xx = np.mgrid[cy - 20:cy + 21, cx - 20:cx + 21]
+        stomate = ((yy - cy) / a) ** 2 + ((xx - cx) / b) ** 2 <= 1
+        pore = ((yy - cy) / (a * 0.5)) ** 2 + ((xx - cx) / (b * 0.3)) ** 2 <= 1
+        crop = img[cy - 20:cy + 21, cx - 20:cx + 21]
+        crop[stomate] = 3000
+        crop[pore] = 200
+    return img
+
+
+def speckled_leaf(size=2048, n_stomata=200, seed=0, background=(1000, 155), clip_range=(1200, 3000)):
+    """returns `synthetic_leaf` on a noisy background (normal, mean and sd `background`), clipped to `clip_range`
+    as with the ('clip', range) image option, which leaves speckle of background pixels above the clip minimum"""
+    from stomatadetector.stomataobjects import clip
+    img = synthetic_leaf(size, n_stomata, seed)
+    noise = np.random.RandomState(seed + 1).normal(background[0], background[1], img.shape).clip(0, 65535)
+    return clip(np.where(img > 0, img, noise).astype('uint16'), clip_range)
+
+
+def write_synthetic_stack(path, planes=3, **kwargs):
+    """writes a multi-plane TIFF of `synthetic_leaf` to `path`"""
+    img = synthetic_leaf(**kwargs)
+    tifffile.imwrite(path, np.stack([img] * planes))
+    return path
+
+
+SEGMENT_OPTIONS = [
+    ('pore_percentile', 35),
+    ('pore_edge_object_margin', 1),
+    ('stomate_max_obj_size', 1000),
+    ('stomate_min_obj_size', 200)
+]
@@ -13,13 +13,14 @@ setup(name='stomatadetector',
       classifiers=[
         'Development Status :: 3 - Alpha',
         'License :: OSI Approved :: MIT License',
-        'Programming Language :: Python :: 3.5',
+        'Programming Language :: Python :: 3.8',
         'Topic :: Scientific/Engineering :: Image Recognition'
       ],
       author='Dan MacLean',
       author_email='dan.maclean@tsl.ac.uk',
       license='MIT',
       packages=['stomatadetector'],
+      python_requires='>=3.8',
       install_requires=[
           'numpy',
           'scipy',
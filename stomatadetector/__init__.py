@@ -1,3 +1,14 @@
 from .filebrowser import *
 from .flexmetadata import FlexMetaData
-from .stomataobjects import *
\ No newline at end of file
+from .flexindex import FlexIndex
+from .stomataobjects import *
+from .compactresults import CompactLeafImage, CompactStomataObject
+from .resultsstore import ResultsStore
+from .watchfolder import WatchFolder
+from .sharedarrays import SharedArray, SharedLeafImage, analyse_flex_file_shared
+from .scheduler import MemoryBudgetScheduler, estimate_memory
+from .intensitystats import IntensityHistogram, plate_histogram
+from .cropexport import CropWriter, CropStore
+from .timeseries import TimeSeriesTracker
+from .asyncanalysis import AsyncStomataObjects, analyse_flex_files_async, queue_source
+from .sparselabels import SparseLabels
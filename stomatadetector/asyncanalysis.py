@@ -0,0 +1,143 @@
+"""Module for analysing flex files from asyncio code without blocking the event loop
+
+The analysis of each file runs in an executor (worker processes by default) while the event loop stays free for
+notebook widgets or an acquisition control service. Files can come from a list or from an async iterable, such as
+`queue_source` over an `asyncio.Queue` that the acquisition side fills as files are written. Results are yielded
+as they complete. At most `max_pending` files are in the executor or waiting to be consumed, so a slow consumer
+holds back submission rather than letting results pile up. Cancelling the consuming task, or leaving the
+`async for` early, cancels the files that haven't started.
+
+>>> async for flex in sd.AsyncStomataObjects(flex_file_names, image_options, segment_options):
+...     print(flex.flex_file, flex.object_count())
+
+or, in the same order as GetStomataObjects
+
+>>> analysed_flex_files = await sd.AsyncStomataObjects(flex_file_names, image_options, segment_options).gather()
+
+"""
+
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from .stomataobjects import analyse_flex_file
+
+
+async def queue_source(queue, sentinel=None):
+    """async iterable of the items put on an asyncio.Queue, ending when `sentinel` is taken from it"""
+    while True:
+        item = await queue.get()
+        if item is sentinel:
+            return
+        yield item
+
+
+async def _source(flex_files):
+    if hasattr(flex_files, '__aiter__'):
+        async for flex_file in flex_files:
+            yield flex_file
+    else:
+        for flex_file in flex_files:
+            yield flex_file
+
+
+async def analyse_flex_files_async(flex_files, image_options=[], segment_options=[], object_filters=[], compact=False,
+                                   executor=None, max_pending=None):
+    """async generator that analyses flex files in an executor and yields LeafImage (or CompactLeafImage) results
+    in the order they complete
+
+    :param flex_files: iterable or async iterable of flex file names
+    :param image_options: list of image options, as for GetStomataObjects
+    :param segment_options: list of segment options, as for GetStomataObjects
+    :param object_filters: list of object filter options, applied in the executor
+    :param compact: return CompactLeafImage results, much cheaper to send back from worker processes
+    :param executor: a concurrent.futures executor, by default a ProcessPoolExecutor is created and shut down here
+    :param max_pending: most files submitted but not yet yielded, defaults to twice the number of CPUs
+    """
+    loop = asyncio.get_running_loop()
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor()
+    max_pending = max_pending or 2 * os.cpu_count()
+    analyse = partial(analyse_flex_file, image_options=image_options, segment_options=segment_options,
+                      object_filters=object_filters, compact=compact)
+    source = _source(flex_files)
+    fetch = None
+    exhausted = False
+    pending = set()
+    try:
+        while True:
+            if fetch is None and not exhausted and len(pending) < max_pending:
+                fetch = asyncio.ensure_future(source.__anext__())
+            waiting = pending | {fetch} if fetch is not None else pending
+            if not waiting:
+                return
+            done, _ = await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+            if fetch in done:
+                done.discard(fetch)
+                try:
+                    flex_file = fetch.result()
+                    pending.add(loop.run_in_executor(executor, analyse, flex_file))
+                except StopAsyncIteration:
+                    exhausted = True
+                fetch = None
+            for future in done:
+                pending.discard(future)
+                yield future.result()
+    finally:
+        try:
+            if fetch is not None and not fetch.done():
+                fetch.cancel()
+                try:
+                    await fetch
+                except (asyncio.CancelledError, StopAsyncIteration):
+                    pass
+            for future in pending:
+                future.cancel()
+            await source.aclose()
+        finally:
+            if own_executor:
+                executor.shutdown(wait=False)
+
+
+class AsyncStomataObjects(object):
+    """asyncio counterpart of GetStomataObjects. Iterate with `async for` to get results as they complete, or
+    `await gather()` for a list in input order, after which the object iterates and indexes like GetStomataObjects
+
+    :param flex_file_name_list: iterable or async iterable of flex file names
+    :param executor: a concurrent.futures executor, see `analyse_flex_files_async`
+    :param max_pending: most files submitted but not yet consumed, see `analyse_flex_files_async`
+    :ivar processed_images: list of results in input order, filled by `gather()`
+
+    """
+
+    def __init__(self, flex_file_name_list, image_options=[], segment_options=[], object_filters=[], compact=False,
+                 executor=None, max_pending=None):
+        self.flex_files = flex_file_name_list
+        self.image_options = image_options
+        self.segment_options = segment_options
+        self.object_filters = object_filters
+        self.compact = compact
+        self.executor = executor
+        self.max_pending = max_pending
+        self.processed_images = []
+
+    def __aiter__(self):
+        return analyse_flex_files_async(self.flex_files, self.image_options, self.segment_options, self.object_filters,
+                                        self.compact, self.executor, self.max_pending)
+
+    async def gather(self):
+        """analyses every file and returns the results in the order of `flex_file_name_list`, which must be a
+        plain iterable here"""
+        self.flex_files = list(self.flex_files)
+        results = {}
+        async for result in self:
+            results[result.flex_file] = result
+        self.processed_images = [results[flex_file] for flex_file in self.flex_files]
+        return self.processed_images
+
+    def __iter__(self):
+        return iter(self.processed_images)
+
+    def __getitem__(self, idx):
+        return self.processed_images[idx]
@@ -0,0 +1,122 @@
+"""Module for compact, measurement-only versions of LeafImage and StomataObject results
+
+The full objects keep the maximum projection, label images and skimage `RegionProperties` (which hold references to
+the full label image) for every file. The compact records here keep only the numbers needed for reporting, the
+position slices and, optionally, small cropped thumbnails, so a whole plate of results stays small in memory and
+is cheap to pickle between processes.
+
+>>> compact = leaf_image.compact()
+>>> compact = leaf_image.compact(thumbnails=True) # keep the per-stomate crops too
+
+"""
+
+import math
+
+
+class CompactStomataObject(object):
+    """measurement-only record of a single StomataObject
+
+    :ivar label: label of the stomate in the parent image
+    :ivar position_in_image: Python slice object describing the position in the original image
+    :ivar centroid: (row, column) centroid of the stomate in the original image
+    :ivar area: area of the stomate in pixels
+    :ivar perimeter: perimeter of the stomate
+    :ivar major_axis_length: major axis length of the stomate
+    :ivar minor_axis_length: minor axis length of the stomate
+    :ivar pore_major_axis_length: major axis length of the pore, None if no pore was found
+    :ivar pore_minor_axis_length: minor axis length of the pore, None if no pore was found
+    :ivar intensity_image: cropped intensity image, None unless thumbnails were kept
+    :ivar detected_stomate: cropped binary image of stomate, None unless thumbnails were kept
+    :ivar pore_binary_image: cropped pore label image, None unless thumbnails were kept or no pore was found
+
+    """
+
+    __slots__ = ('label', 'position_in_image', 'centroid', 'area', 'perimeter', 'major_axis_length',
+                 'minor_axis_length', 'pore_major_axis_length', 'pore_minor_axis_length', 'intensity_image',
+                 'detected_stomate', 'pore_binary_image')
+
+    def __init__(self, stomata_object, thumbnails=False):
+        props = stomata_object.props
+        self.label = stomata_object.label
+        self.position_in_image = stomata_object.position_in_image
+        self.centroid = tuple(float(c) for c in props.centroid)
+        self.area = float(props.area)
+        self.perimeter = float(props.perimeter)
+        self.major_axis_length = float(props.major_axis_length)
+        self.minor_axis_length = float(props.minor_axis_length)
+        self.pore_major_axis_length = None
+        self.pore_minor_axis_length = None
+        if stomata_object.pore_props is not None:
+            self.pore_major_axis_length = float(stomata_object.pore_props.major_axis_length)
+            self.pore_minor_axis_length = float(stomata_object.pore_props.minor_axis_length)
+
+        self.intensity_image = None
+        self.detected_stomate = None
+        self.pore_binary_image = None
+        if thumbnails:
+            self.intensity_image = stomata_object.intensity_image.copy()
+            self.detected_stomate = stomata_object.detected_stomate
+            self.pore_binary_image = stomata_object.pore_binary_image
+
+    def roundness(self):
+        return 4 * math.pi * (self.area / (self.perimeter ** 2))
+
+    def width_length_ratio(self):
+        return self.major_axis_length / self.minor_axis_length
+
+    def original_width_length_ratio(self):
+        """strange function for width to length found in original Ji Zhou, Opera version of this procedure.
+        """
+        return (self.area / (self.major_axis_length / 2) / self.major_axis_length)
+
+    def ramanujan_perimeter(self):
+        a = self.major_axis_length
+        b = self.minor_axis_length
+        h = ((a - b)**2)/((a + b)**2)
+        c = 1 + ((3*h) / (10 + math.sqrt(4 + (3 * h) ) ) )
+        return (math.pi * (a+b) * c)
+
+    def stoma_info(self):
+        return [self.label, self.area, self.roundness(), self.major_axis_length, self.minor_axis_length,
+                str(self.pore_major_axis_length), str(self.pore_minor_axis_length)]
+
+
+class CompactLeafImage(object):
+    """measurement-only record of a LeafImage. Has the same reporting interface as LeafImage
+    (`sample_info()`, `object_count()`, `stomata_objects`) so can be passed to `custom_report`
+
+    :ivar flex_file: the flex file represented
+    :ivar shape: shape of the maximum projection
+    :ivar is_dark: result of `is_dark_image` on the maximum projection
+    :ivar stomata_positions: the python Slice objects describing the sub images containing detected stomata
+    :ivar stomata_objects: list of CompactStomataObject's - one per detected stomate
+
+    """
+
+    __slots__ = ('flex_file', 'shape', 'is_dark', 'stomata_positions', 'stomata_objects', 'treatment',
+                 'plate_row', 'plate_column', 'imaging_time', 'x_units', 'x_perpixel', 'y_units', 'y_perpixel',
+                 'stack', 'camerabinning_x', 'camerabinning_y')
+
+    def __init__(self, leaf_image, thumbnails=False):
+        self.flex_file = leaf_image.flex_file
+        self.shape = leaf_image.mp.shape
+        self.is_dark = leaf_image.is_dark
+        self.stomata_positions = [s.position_in_image for s in leaf_image.stomata_objects]
+        self.stomata_objects = [s if isinstance(s, CompactStomataObject) else CompactStomataObject(s, thumbnails) for s in leaf_image.stomata_objects]
+        self.treatment = leaf_image.treatment
+        self.plate_row = leaf_image.plate_row
+        self.plate_column = leaf_image.plate_column
+        self.imaging_time = leaf_image.imaging_time
+        self.x_units = leaf_image.x_units
+        self.x_perpixel = leaf_image.x_perpixel
+        self.y_units = leaf_image.y_units
+        self.y_perpixel = leaf_image.y_perpixel
+        self.stack = leaf_image.stack
+        self.camerabinning_x = leaf_image.camerabinning_x
+        self.camerabinning_y = leaf_image.camerabinning_y
+
+    def object_count(self):
+        return len(self.stomata_objects)
+
+    def sample_info(self):
+        return [self.treatment, self.plate_row, self.plate_column,  self.imaging_time, self.x_units, self.x_perpixel, self.y_units, self.y_perpixel, self.stack, self.camerabinning_x, self.camerabinning_y]
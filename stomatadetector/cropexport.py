@@ -0,0 +1,218 @@
+"""Module for exporting per-stomate crops to a compact, memory-mappable store, e.g. for training classifiers
+
+The `intensity_image`, `detected_stomate` and `pore_binary_image` crops of every StomataObject are appended to
+three flat binary buffers as the images are analysed, and one fixed size record per crop in `index.bin` holds
+where the crop starts, its shape and its `stoma_info()` fields. Sample information for each image is appended
+to `images.jsonl`, one JSON line per image. Everything is written and flushed image by image, crops before their
+index rows, so memory use doesn't grow with the number of crops and a store cut short by a crash still opens,
+with every image added before it. Loading maps the buffers and the index with `numpy.memmap`, so any crop can be
+read without unpacking the others.
+
+>>> with sd.CropWriter('plate1_crops') as writer:
+...     writer.add_files(flex_file_names, image_options, segment_options, object_filters)
+>>> crops = sd.CropStore('plate1_crops')
+>>> crops[10]['intensity']
+>>> crops.batch(range(64), (48, 48))['intensity'].shape
+(64, 48, 48)
+
+"""
+
+import os
+import json
+import numpy as np
+from .stomataobjects import analyse_flex_file
+
+BUFFERS = ('intensity', 'stomate', 'pore')
+
+INDEX_DTYPE = [
+    ('offset', 'i8'),
+    ('height', 'i4'),
+    ('width', 'i4'),
+    ('image_id', 'i4'),
+    ('image_row', 'i4'),
+    ('image_column', 'i4'),
+    ('label', 'i4'),
+    ('area', 'f8'),
+    ('roundness', 'f8'),
+    ('stomate_length', 'f8'),
+    ('stomate_width', 'f8'),
+    ('pore_length', 'f8'),
+    ('pore_width', 'f8'),
+]
+
+
+def _float_or_nan(value):
+    return float('nan') if value is None or value == 'None' else float(value)
+
+
+def _map(path, dtype):
+    """memory maps the whole records of a file, an empty array if it has none"""
+    count = os.path.getsize(path) // np.dtype(dtype).itemsize
+    if count == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', shape=(count,))
+
+
+class CropWriter(object):
+    """Implements streaming export of stomata crops to a directory
+
+    :param directory: output directory, created if needed. Existing crops in it are replaced
+    :param intensity_dtype: dtype the intensity crops are stored as, by default the dtype of the first crop
+        (usually uint16), which later crops must cast to without changing kind
+    :ivar count: number of crops written
+    :ivar image_count: number of images added
+    """
+
+    def __init__(self, directory, intensity_dtype=None):
+        self.directory = directory
+        self.intensity_dtype = None if intensity_dtype is None else np.dtype(intensity_dtype)
+        self._cast_any = intensity_dtype is not None
+        os.makedirs(directory, exist_ok=True)
+        self._files = dict((name, open(os.path.join(directory, name + '.bin'), 'wb')) for name in BUFFERS)
+        self._index_file = open(os.path.join(directory, 'index.bin'), 'wb')
+        self._images_file = open(os.path.join(directory, 'images.jsonl'), 'w')
+        if self.intensity_dtype is not None:
+            self._write_meta()
+        self.image_count = 0
+        self.count = 0
+        self._offset = 0
+
+    def _write_meta(self):
+        with open(os.path.join(self.directory, 'meta.json'), 'w') as f:
+            json.dump({'intensity_dtype': self.intensity_dtype.str}, f)
+
+    def _intensity(self, crop):
+        if self.intensity_dtype is None:
+            self.intensity_dtype = crop.dtype
+            self._write_meta()
+        elif not self._cast_any and not np.can_cast(crop.dtype, self.intensity_dtype, 'same_kind'):
+            raise ValueError("crop of dtype {} can't be stored as {}, give CropWriter an intensity_dtype".format(crop.dtype, self.intensity_dtype))
+        return np.ascontiguousarray(crop, dtype=self.intensity_dtype)
+
+    def add(self, leaf_image):
+        """appends the crops of every stomate of a LeafImage, or of a CompactLeafImage made with thumbnails
+
+        :return: int -- the image_id given to the image
+        """
+        if any(s.intensity_image is None for s in leaf_image.stomata_objects):
+            raise ValueError("{} has no crops, use a LeafImage or compact(thumbnails=True)".format(leaf_image.flex_file))
+        image_id = self.image_count
+        self._images_file.write(json.dumps({'flex_file': leaf_image.flex_file, 'sample_info': [None if v is None else str(v) for v in leaf_image.sample_info()]}) + '\n')
+        self._images_file.flush()
+        self.image_count += 1
+        index = np.zeros(len(leaf_image.stomata_objects), dtype=INDEX_DTYPE)
+        for n, s in enumerate(leaf_image.stomata_objects):
+            height, width = s.intensity_image.shape
+            self._files['intensity'].write(self._intensity(s.intensity_image).tobytes())
+            self._files['stomate'].write(np.ascontiguousarray(s.detected_stomate, dtype=np.uint8).tobytes())
+            pore = s.pore_binary_image if s.pore_binary_image is not None else np.zeros((height, width))
+            self._files['pore'].write(np.ascontiguousarray(pore, dtype=np.uint8).tobytes())
+            info = s.stoma_info()
+            index[n] = (self._offset, height, width, image_id, s.position_in_image[0].start,
+                        s.position_in_image[1].start, info[0]) + tuple(_float_or_nan(v) for v in info[1:])
+            self._offset += height * width
+        for f in self._files.values(): #crops reach the files before the index rows pointing at them
+            f.flush()
+        self._index_file.write(index.tobytes())
+        self._index_file.flush()
+        self.count += len(index)
+        return image_id
+
+    def add_all(self, leaf_images):
+        """appends every image in an iterable, e.g. a GetStomataObjects result or a WatchFolder.watch() generator"""
+        for leaf_image in leaf_images:
+            self.add(leaf_image)
+        return self.count
+
+    def add_files(self, flex_files, image_options=[], segment_options=[], object_filters=[], memory_budget=None, workers=None):
+        """analyses flex files and appends their crops as each one finishes, so only one analysed image (or one per
+        worker) is held at a time
+
+        :param flex_files: list of flex file names
+        :param image_options: list of image options, as for GetStomataObjects
+        :param segment_options: list of segment options, as for GetStomataObjects
+        :param object_filters: list of object filter options, applied before the crops are written
+        :param memory_budget: analyse in worker processes with a MemoryBudgetScheduler under this many bytes,
+            images are then added in the order they finish. None analyses one file at a time in this process
+        :param workers: most worker processes with `memory_budget`
+        :return: int -- number of crops written
+        """
+        if memory_budget is None:
+            for flex_file in flex_files:
+                self.add(analyse_flex_file(flex_file, image_options, segment_options, object_filters))
+            return self.count
+        from .scheduler import MemoryBudgetScheduler
+        scheduler = MemoryBudgetScheduler(memory_budget, workers, image_options, segment_options, object_filters,
+                                          compact=True, thumbnails=True)
+        for _, result in scheduler.as_completed(list(flex_files)):
+            self.add(result)
+        return self.count
+
+    def close(self):
+        """closes the buffers, the index and the image table"""
+        if self.intensity_dtype is None: #no crops were written
+            self.intensity_dtype = np.dtype('uint16')
+            self._write_meta()
+        for f in list(self._files.values()) + [self._index_file, self._images_file]:
+            f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class CropStore(object):
+    """Implements memory-mapped, random access reading of a CropWriter directory
+
+    :param directory: directory written by CropWriter
+    :ivar table: structured numpy array, one row per crop, with the offsets, shapes, positions and `stoma_info()`
+        fields (pore fields are NaN where no pore was found)
+    :ivar images: list of dicts of 'flex_file' and 'sample_info', indexed by the table's image_id
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        meta_file = os.path.join(directory, 'meta.json')
+        intensity_dtype = 'uint16' #no crops were written before a crash
+        if os.path.exists(meta_file):
+            with open(meta_file) as f:
+                intensity_dtype = json.load(f)['intensity_dtype']
+        self.images = []
+        with open(os.path.join(directory, 'images.jsonl')) as f:
+            for line in f:
+                if line.endswith('\n'): #a line cut short by a crash is dropped
+                    self.images.append(json.loads(line))
+        self.table = _map(os.path.join(directory, 'index.bin'), INDEX_DTYPE)
+        dtypes = {'intensity': np.dtype(intensity_dtype), 'stomate': np.dtype(np.uint8), 'pore': np.dtype(np.uint8)}
+        self._buffers = dict((name, _map(os.path.join(directory, name + '.bin'), dtypes[name])) for name in BUFFERS)
+
+    def __len__(self):
+        return len(self.table)
+
+    def __getitem__(self, i):
+        """returns dict of 'intensity', 'stomate', 'pore': read-only views of crop i"""
+        row = self.table[i]
+        start, shape = int(row['offset']), (int(row['height']), int(row['width']))
+        stop = start + shape[0] * shape[1]
+        return dict((name, self._buffers[name][start:stop].reshape(shape)) for name in BUFFERS)
+
+    def batch(self, indices, size):
+        """returns dict of 'intensity', 'stomate', 'pore': arrays of shape (len(indices), height, width) with the
+        crops zero padded, or centre cropped, to `size`
+
+        :param indices: crop indices
+        :param size: (height, width)
+        """
+        indices = list(indices)
+        out = dict((name, np.zeros((len(indices),) + tuple(size), dtype=buf.dtype)) for name, buf in self._buffers.items())
+        for n, i in enumerate(indices):
+            crop = self[i]
+            h, w = crop['intensity'].shape
+            src_r, src_c = max((h - size[0]) // 2, 0), max((w - size[1]) // 2, 0)
+            dst_r, dst_c = max((size[0] - h) // 2, 0), max((size[1] - w) // 2, 0)
+            rows, cols = min(h, size[0]), min(w, size[1])
+            for name in BUFFERS:
+                out[name][n, dst_r:dst_r + rows, dst_c:dst_c + cols] = crop[name][src_r:src_r + rows, src_c:src_c + cols]
+        return out
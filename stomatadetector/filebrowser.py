@@ -5,15 +5,23 @@
 import os
 import ipywidgets as widgets
 import glob
+from .flexindex import FlexIndex
 
-def GetFlexList(path):
+def GetFlexList(path, recursive=False, index_file=None):
     """
     Returns a list of files ending in *.flex in provided folder
 
     :param: path
+    :param recursive: also find files in all sub folders, using a FlexIndex
+    :type recursive: bool
+    :param index_file: with `recursive`, the file the FlexIndex is persisted in so later calls only rescan changed folders
     :return: list -- filenames
 
     """
+    if recursive:
+        index = FlexIndex(path, index_file=index_file)
+        index.scan()
+        return list(index)
     path += '/*.flex'
     return glob.glob(path)
 
@@ -37,10 +45,10 @@ class FileBrowser(object):
         self.files = list()
         self.dirs = list()
         if os.path.isdir(self.path):
-            for f in os.listdir(self.path):
-                ff = self.path + "/" + f
-                if os.path.isdir(ff) and f[0] != '.':
-                    self.dirs.append(f)
+            with os.scandir(self.path) as it:
+                for f in it:
+                    if f.is_dir() and f.name[0] != '.':
+                        self.dirs.append(f.name)
                     # else:
                     # self.files.append(f)
 
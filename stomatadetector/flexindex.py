@@ -0,0 +1,157 @@
+"""Module for recursive discovery of .flex files and a persisted index of them
+
+Campaigns are usually nested as campaign/plate/timepoint folders. `FlexIndex` walks the tree with `os.scandir`
+and records every .flex file with its size, mtime and the well information from `well_info`. Rescans only list
+directories whose mtime has changed since the last scan, and only re-read the header of files whose size or
+mtime has changed, so repeated scans of a large tree are cheap. Appending to a file doesn't change its
+directory's mtime, so files whose header couldn't be read yet (e.g. still being written) are re-checked on every
+scan until it can. Selecting files by well or treatment uses the
+index only and never opens the files.
+
+>>> index = sd.FlexIndex('/data/campaign1', index_file='/data/campaign1/.flexindex.json')
+>>> index.scan()
+>>> index.select(plate_row=2, plate_column=4)
+>>> index.select(treatment='CW01', under='/data/campaign1/plate3')
+
+"""
+
+import os
+import json
+from .flexmetadata import well_info
+
+
+class FlexIndex(object):
+    """Implements a recursive, incrementally updated index of .flex files under a root folder
+
+    :param root: the folder to index
+    :param index_file: JSON file the index is loaded from and saved to, None to keep it in memory only
+    :param check_files: on rescans, also stat the indexed files in directories whose mtime hasn't changed. Needed to
+        notice complete files that are rewritten in place, at the cost of one stat per file. Files without well
+        information are always re-checked
+    :type check_files: bool
+    :ivar files: dict of flex file name: dict of 'size', 'mtime', 'treatment', 'plate_row', 'plate_column', 'imaging_time'
+    :ivar dirs: dict of directory name: dict of 'mtime', 'subdirs', 'files'
+
+    """
+
+    def __init__(self, root, index_file=None, check_files=False):
+        self.root = os.path.abspath(root)
+        self.index_file = index_file
+        self.check_files = check_files
+        self.files = {}
+        self.dirs = {}
+        if index_file is not None and os.path.exists(index_file):
+            self.load()
+
+    def scan(self):
+        """updates the index from the file system, re-listing only changed directories
+
+        :return: list -- the flex file names that were added or changed since the last scan
+        """
+        changed = []
+        seen_dirs = set()
+        stack = [self.root]
+        while stack:
+            path = stack.pop()
+            try:
+                mtime = os.stat(path).st_mtime
+            except OSError: #removed since the parent was listed
+                continue
+            seen_dirs.add(path)
+            entry = self.dirs.get(path)
+            if entry is None or entry['mtime'] != mtime:
+                entry = self._scan_dir(path, mtime, changed)
+            else:
+                for flex_file in entry['files']:
+                    if self.check_files or self.files.get(flex_file, {}).get('plate_row') is None:
+                        self._update_file(flex_file, None, changed)
+            stack.extend(entry['subdirs'])
+
+        for path in set(self.dirs) - seen_dirs:
+            for flex_file in self.dirs.pop(path)['files']:
+                self.files.pop(flex_file, None)
+        if self.index_file is not None:
+            self.save()
+        return sorted(changed)
+
+    def _scan_dir(self, path, mtime, changed):
+        subdirs = []
+        files = []
+        with os.scandir(path) as it:
+            for e in it:
+                if e.name.startswith('.'):
+                    continue
+                if e.is_dir(follow_symlinks=False):
+                    subdirs.append(e.path)
+                elif e.name.endswith('.flex') and e.is_file():
+                    files.append(e.path)
+                    self._update_file(e.path, e, changed)
+        for flex_file in set(self.dirs.get(path, {}).get('files', [])) - set(files):
+            self.files.pop(flex_file, None)
+        entry = {'mtime': mtime, 'subdirs': sorted(subdirs), 'files': sorted(files)}
+        self.dirs[path] = entry
+        return entry
+
+    def _update_file(self, flex_file, dir_entry, changed):
+        try:
+            stat = dir_entry.stat() if dir_entry is not None else os.stat(flex_file)
+        except OSError:
+            self.files.pop(flex_file, None)
+            return
+        old = self.files.get(flex_file)
+        if old is not None and old['size'] == stat.st_size and old['mtime'] == stat.st_mtime:
+            return
+        record = {'size': stat.st_size, 'mtime': stat.st_mtime}
+        try:
+            record.update(well_info(flex_file))
+        except Exception: #partially written or not a flex file, re-read on later scans once its size or mtime changes
+            record.update({'treatment': None, 'plate_row': None, 'plate_column': None, 'imaging_time': None})
+        self.files[flex_file] = record
+        changed.append(flex_file)
+
+    def select(self, plate_row=None, plate_column=None, treatment=None, under=None):
+        """returns indexed flex files matching all of the given values, without opening any file
+
+        :param plate_row: well row
+        :type plate_row: int
+        :param plate_column: well column
+        :type plate_column: int
+        :param treatment: treatment (the flex AreaName)
+        :type treatment: str
+        :param under: only files below this folder
+        :type under: str
+        :return: list -- sorted flex file names
+        """
+        if under is not None:
+            under = os.path.join(os.path.abspath(under), '')
+        selected = []
+        for flex_file, record in self.files.items():
+            if plate_row is not None and record['plate_row'] != int(plate_row):
+                continue
+            if plate_column is not None and record['plate_column'] != int(plate_column):
+                continue
+            if treatment is not None and record['treatment'] != treatment:
+                continue
+            if under is not None and not flex_file.startswith(under):
+                continue
+            selected.append(flex_file)
+        return sorted(selected)
+
+    def save(self):
+        tmp = self.index_file + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'root': self.root, 'dirs': self.dirs, 'files': self.files}, f)
+        os.replace(tmp, self.index_file)
+
+    def load(self):
+        with open(self.index_file) as f:
+            index = json.load(f)
+        if index.get('root') == self.root:
+            self.dirs = index['dirs']
+            self.files = index['files']
+
+    def __iter__(self):
+        return iter(sorted(self.files))
+
+    def __len__(self):
+        return len(self.files)
@@ -11,6 +11,32 @@ import tifffile as tf
 def count_planes_in_stack(flxml_arr):
     return len(flxml_arr)
 
+def well_info(flex_filepath):
+    """Cheap well metadata from a .flex file. Parses only the xml of the first image in the file, not every plane
+    as FlexMetaData does, and reads no pixel data.
+
+    :param flex_filepath: the flex file
+    :return: dict -- with keys 'treatment', 'plate_row', 'plate_column', 'imaging_time'. Values are None if not found.
+    """
+    info = {'treatment': None, 'plate_row': None, 'plate_column': None, 'imaging_time': None}
+    with tf.TiffFile(flex_filepath) as flex:
+        tags = flex.pages[0].tags
+        tag = tags.get('flex_xml')
+        if tag is None: #newer tifffile names tag 65200 'FlexXML'
+            tag = tags.get(65200)
+        if tag is None:
+            return info
+        well = xmltodict.parse(tag.value)['Root']['FLEX']['Well']
+    info['treatment'] = well.get('AreaName')
+    info['plate_row'] = int(well['WellCoordinate']['@Row'])
+    info['plate_column'] = int(well['WellCoordinate']['@Col'])
+    images = well['Images']['Image']
+    if isinstance(images, list):
+        images = images[0]
+    date_time = images['DateTime']
+    info['imaging_time'] = date_time['#text'] if isinstance(date_time, dict) else date_time
+    return info
+
 class FlexMetaData(object):
 
     """
@@ -0,0 +1,96 @@
+"""Module for streaming, mergeable intensity statistics of uint16 maximum projections
+
+An `IntensityHistogram` counts every uint16 value, so histograms from different files, or built in different
+worker processes, can be added together exactly and percentiles of a whole plate read from the sum. These
+percentiles give the `clip` image option range automatically, see `('clip', 'auto')` in GetStomataObjects.
+
+>>> hist = sd.IntensityHistogram()
+>>> for flex_file in flex_file_names:
+...     hist.update(sd.stomataobjects.maximum_project_flex(flex_file))
+>>> hist.clip_range(1, 99.5)
+(52, 104)
+
+"""
+
+import numpy as np
+
+N_VALUES = 65536
+
+
+class IntensityHistogram(object):
+    """Implements a histogram with one bin per uint16 value. Also used for the cached `LeafImage.intensity_histogram`
+
+    :ivar counts: numpy.ndarray of 65536 int64 counts
+    """
+
+    def __init__(self, counts=None):
+        self.counts = np.zeros(N_VALUES, dtype=np.int64) if counts is None else np.asarray(counts, dtype=np.int64)
+
+    @classmethod
+    def from_image(cls, img):
+        hist = cls()
+        hist.update(img)
+        return hist
+
+    def update(self, img):
+        """adds the pixels of a uint16 (or uint8) image to the histogram
+
+        :param img: image
+        :type img: numpy.ndarray, uint16
+        """
+        if img.dtype.kind != 'u' or img.dtype.itemsize > 2:
+            raise ValueError("IntensityHistogram needs a uint16 image, got {}".format(img.dtype))
+        self.counts += np.bincount(img.ravel(), minlength=N_VALUES)
+        return self
+
+    def merge(self, other):
+        """adds the counts of another IntensityHistogram to this one"""
+        self.counts += other.counts
+        return self
+
+    def __add__(self, other):
+        return IntensityHistogram(self.counts + other.counts)
+
+    def __iadd__(self, other):
+        return self.merge(other)
+
+    def total(self):
+        return int(self.counts.sum())
+
+    def percentile(self, q):
+        """returns the smallest value with at least q percent of pixels at or below it
+
+        :param q: percentile, 0 to 100
+        :type q: float
+        :return: int
+        """
+        total = self.total()
+        if total == 0:
+            raise ValueError("percentile of an empty IntensityHistogram")
+        cumulative = np.cumsum(self.counts)
+        return int(np.searchsorted(cumulative, total * q / 100.0, side='left'))
+
+    def clip_range(self, low=1, high=99.5):
+        """returns the (low, high) percentile values, for use as the `clip` image option range"""
+        return (self.percentile(low), self.percentile(high))
+
+
+def flex_file_histogram(flex_file):
+    """IntensityHistogram of the maximum projection of a flex file. Is a module level function so it can be
+    sent to worker processes"""
+    from .stomataobjects import maximum_project_flex
+    return IntensityHistogram.from_image(maximum_project_flex(flex_file))
+
+
+def plate_histogram(flex_files, executor=None):
+    """returns the merged IntensityHistogram of the maximum projections of many flex files
+
+    :param flex_files: list of flex file names
+    :param executor: optional concurrent.futures executor to build the per-file histograms in
+    :return: IntensityHistogram
+    """
+    histograms = executor.map(flex_file_histogram, flex_files) if executor is not None else map(flex_file_histogram, flex_files)
+    plate = IntensityHistogram()
+    for hist in histograms:
+        plate.merge(hist)
+    return plate
@@ -0,0 +1,161 @@
+"""Module for storing LeafImage results in a local SQLite database and querying plate level aggregates
+
+Each LeafImage (or CompactLeafImage) adds one row to the `images` table from `sample_info()` and one row per
+stomate to the `stomata` table from `stoma_info()`, with the values stored as numbers rather than strings.
+The sample fields used for grouping are repeated on the stomata rows and indexed, so aggregates per well,
+treatment and time point are answered by SQLite without loading the whole dataset.
+
+>>> store = sd.ResultsStore('plate1.sqlite')
+>>> store.add_all(analysed_flex_files)
+>>> store.treatment_summary('pore_width')
+>>> store.well_summary('pore_width', where={'treatment': 'CW01'})
+
+"""
+
+import sqlite3
+
+IMAGE_COLUMNS = [
+    ('flex_file', 'TEXT'),
+    ('treatment', 'TEXT'),
+    ('plate_row', 'INTEGER'),
+    ('plate_column', 'INTEGER'),
+    ('timestamp', 'TEXT'),
+    ('x_units', 'TEXT'),
+    ('x_perpixel', 'REAL'),
+    ('y_units', 'TEXT'),
+    ('y_perpixel', 'REAL'),
+    ('stack', 'INTEGER'),
+    ('camerabinning_x', 'INTEGER'),
+    ('camerabinning_y', 'INTEGER'),
+    ('object_count', 'INTEGER'),
+]
+
+GROUP_COLUMNS = ['treatment', 'plate_row', 'plate_column', 'timestamp']
+
+STOMATA_COLUMNS = [
+    ('stomate_index', 'INTEGER'),
+    ('area', 'REAL'),
+    ('roundness', 'REAL'),
+    ('length', 'REAL'),
+    ('width', 'REAL'),
+    ('pore_length', 'REAL'),
+    ('pore_width', 'REAL'),
+]
+
+_TYPES = {'TEXT': str, 'INTEGER': int, 'REAL': float}
+
+
+def _convert(value, sql_type):
+    """converts a value from `sample_info()` or `stoma_info()` to the python type for its column, None and
+    'None' are stored as NULL"""
+    if value is None or value == 'None':
+        return None
+    if sql_type == 'INTEGER':
+        return int(float(value))
+    return _TYPES[sql_type](value)
+
+
+class ResultsStore(object):
+    """Implements an SQLite store of per-image and per-stomate results
+
+    :param path: the database file, created if it doesn't exist. Use ':memory:' for a temporary store
+    :type path: str
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self._create_tables()
+
+    def _create_tables(self):
+        image_cols = ", ".join("{} {}".format(name, sql_type) for name, sql_type in IMAGE_COLUMNS)
+        group_cols = ", ".join("{} {}".format(name, sql_type) for name, sql_type in IMAGE_COLUMNS if name in GROUP_COLUMNS)
+        stomata_cols = ", ".join("{} {}".format(name, sql_type) for name, sql_type in STOMATA_COLUMNS)
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS images (image_id INTEGER PRIMARY KEY, {})".format(image_cols))
+            self.connection.execute("CREATE TABLE IF NOT EXISTS stomata (image_id INTEGER REFERENCES images(image_id), {}, {})".format(group_cols, stomata_cols))
+            for table in ['images', 'stomata']:
+                self.connection.execute("CREATE INDEX IF NOT EXISTS {0}_treatment ON {0} (treatment, timestamp)".format(table))
+                self.connection.execute("CREATE INDEX IF NOT EXISTS {0}_well ON {0} (plate_row, plate_column, timestamp)".format(table))
+                self.connection.execute("CREATE INDEX IF NOT EXISTS {0}_timestamp ON {0} (timestamp)".format(table))
+
+    def _insert(self, leaf_image):
+        sample = [leaf_image.flex_file] + list(leaf_image.sample_info()) + [leaf_image.object_count()]
+        image_row = [_convert(v, t) for v, (_, t) in zip(sample, IMAGE_COLUMNS)]
+        cursor = self.connection.execute(
+            "INSERT INTO images ({}) VALUES ({})".format(", ".join(name for name, _ in IMAGE_COLUMNS), ", ".join("?" * len(IMAGE_COLUMNS))),
+            image_row)
+        image_id = cursor.lastrowid
+
+        group_values = [v for v, (name, _) in zip(image_row, IMAGE_COLUMNS) if name in GROUP_COLUMNS]
+        stomata_rows = [[image_id] + group_values + [_convert(v, t) for v, (_, t) in zip(s.stoma_info(), STOMATA_COLUMNS)]
+                        for s in leaf_image.stomata_objects]
+        names = ['image_id'] + GROUP_COLUMNS + [name for name, _ in STOMATA_COLUMNS]
+        self.connection.executemany(
+            "INSERT INTO stomata ({}) VALUES ({})".format(", ".join(names), ", ".join("?" * len(names))),
+            stomata_rows)
+        return image_id
+
+    def add(self, leaf_image):
+        """adds the sample and stomata information of a LeafImage or CompactLeafImage to the store
+
+        :param leaf_image: the analysed image
+        :return: int -- the image_id of the new images row
+        """
+        with self.connection:
+            return self._insert(leaf_image)
+
+    def add_all(self, leaf_images):
+        """adds every image in an iterable (e.g. a GetStomataObjects result) in one transaction
+
+        :return: list -- the image_id of each new images row
+        """
+        with self.connection:
+            return [self._insert(leaf_image) for leaf_image in leaf_images]
+
+    def aggregate(self, field, by=('treatment', 'timestamp'), where=None, table='stomata'):
+        """returns count, mean, minimum and maximum of `field` grouped by the columns in `by`
+
+        :param field: the column to summarise, e.g. 'pore_width' or 'area'
+        :type field: str
+        :param by: the columns to group by, any of 'treatment', 'plate_row', 'plate_column', 'timestamp'
+        :type by: tuple
+        :param where: equality filters as a dict of column: value, e.g. {'treatment': 'CW01'}
+        :type where: dict
+        :param table: 'stomata' for per-stomate fields, 'images' for per-image fields such as 'object_count'
+        :return: list of tuples -- (*group values, count, mean, min, max), NULL values are not counted
+        """
+        columns = {'stomata': GROUP_COLUMNS + [name for name, _ in STOMATA_COLUMNS],
+                   'images': [name for name, _ in IMAGE_COLUMNS]}
+        if table not in columns:
+            raise ValueError("unknown table {}".format(table))
+        where = where or {}
+        for name in [field] + list(by) + list(where):
+            if name not in columns[table]:
+                raise ValueError("unknown column {} in table {}".format(name, table))
+
+        group = ", ".join(by)
+        query = "SELECT {0}{1} COUNT({2}), AVG({2}), MIN({2}), MAX({2}) FROM {3}".format(group, ", " if by else "", field, table)
+        if where:
+            query += " WHERE " + " AND ".join("{} = ?".format(name) for name in where)
+        if by:
+            query += " GROUP BY {0} ORDER BY {0}".format(group)
+        return self.connection.execute(query, list(where.values())).fetchall()
+
+    def well_summary(self, field, where=None):
+        """`aggregate` of `field` per plate well and time point"""
+        return self.aggregate(field, by=('plate_row', 'plate_column', 'timestamp'), where=where)
+
+    def treatment_summary(self, field, where=None):
+        """`aggregate` of `field` per treatment and time point"""
+        return self.aggregate(field, by=('treatment', 'timestamp'), where=where)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
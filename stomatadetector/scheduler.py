@@ -0,0 +1,218 @@
+"""Module for running batches of flex files in worker processes under a global memory budget
+
+Peak memory of a LeafImage depends on the number of planes, the frame size and the image options. Before any
+pixels are read, `estimate_memory` predicts each file's peak from its TIFF header. `MemoryBudgetScheduler` only
+starts a file when its estimate, plus the base memory of a worker process (interpreter and imports) for each
+worker, fits in the budget. With the fork start method the pool starts all its workers at once, so their base
+memory is reserved up front and the number of workers is capped to fit the budget. Each worker measures the real
+peak resident memory of every file it analyses with `resource.getrusage`, and the ratio of measured to estimated
+peaks corrects the estimates of the files still queued. The measured base memory of the workers replaces
+`WORKER_BASE_BYTES`.
+
+>>> scheduler = sd.MemoryBudgetScheduler(8 * 1024 ** 3, image_options=image_options, segment_options=segment_options)
+>>> analysed_flex_files = scheduler.map(flex_file_names)
+
+or, through GetStomataObjects
+
+>>> analysed_flex_files = sd.GetStomataObjects(flex_file_names, image_options, segment_options, memory_budget=8 * 1024 ** 3)
+
+"""
+
+import os
+import sys
+import multiprocessing
+import numpy as np
+import tifffile as tf
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from .stomataobjects import analyse_flex_file
+try:
+    import resource
+except ImportError: #not available on Windows, peaks aren't measured there
+    resource = None
+
+#: bytes per frame pixel used by segmentation of a uint16 projection (dilation, reconstruction, labelling)
+SEGMENT_BYTES_PER_PIXEL = 104
+#: extra bytes per frame pixel when an image option leaves a float64 projection
+FLOAT_PROJECTION_BYTES_PER_PIXEL = 13
+#: image options whose output is a float64 projection
+FLOAT_IMAGE_OPTIONS = ('adaptive',)
+#: assumed resident memory of an idle worker process with stomatadetector imported, until one is measured
+WORKER_BASE_BYTES = 150 * 1024 ** 2
+
+
+def estimate_memory(flex_file, image_options=[], projected=False):
+    """estimates the peak memory, in bytes, of analysing a flex file. Reads the TIFF header only.
+    The stack is freed after projection, so the peak is the larger of reading and projecting the stack,
+    or segmenting the projection.
+
+    :param flex_file: the flex file
+    :param image_options: list of image options, or a Qopts object
+    :param projected: the maximum projection is already computed, so the stack isn't read
+    :type projected: bool
+    :return: int -- estimated peak bytes
+    """
+    with tf.TiffFile(flex_file) as flex:
+        page = flex.pages[0]
+        planes = len(flex.pages) * int(np.prod(page.shape[:-2])) #pages may hold more than one plane
+        frame = page.shape[-2] * page.shape[-1]
+        itemsize = page.dtype.itemsize
+    projection = 0 if projected else planes * frame * itemsize + 2 * frame * itemsize
+    per_pixel = SEGMENT_BYTES_PER_PIXEL
+    if any(func in FLOAT_IMAGE_OPTIONS for func, _ in image_options):
+        per_pixel += FLOAT_PROJECTION_BYTES_PER_PIXEL
+    return int(max(projection, frame * per_pixel))
+
+
+def _current_rss():
+    """resident memory of this process in bytes, None where /proc isn't available"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _peak_rss():
+    """peak resident memory of this process in bytes, since the start or the last `_reset_peak_rss`"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024 #kilobytes except on macOS
+
+
+def _reset_peak_rss():
+    """resets the peak resident memory to the current one, returns False where that isn't possible (not Linux)"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def analyse_flex_file_measured(flex_file, image_options=[], segment_options=[], object_filters=[], compact=False, thumbnails=False, projection=None):
+    """`analyse_flex_file` that also measures its peak resident memory. The peak is the process's peak resident
+    memory while analysing, less its resident memory before, which is the worker's base memory. Where the peak
+    can't be reset between files (anything but Linux) only files that raise the process's peak are measured
+
+    :return: tuple -- (LeafImage or CompactLeafImage, peak bytes or None, base bytes or None)
+    """
+    base = _current_rss()
+    if resource is None or base is None:
+        return analyse_flex_file(flex_file, image_options, segment_options, object_filters, compact, thumbnails, projection), None, None
+    reset = _reset_peak_rss()
+    previous_peak = _peak_rss()
+    result = analyse_flex_file(flex_file, image_options, segment_options, object_filters, compact, thumbnails, projection)
+    peak = _peak_rss()
+    if not reset and peak <= previous_peak:
+        return result, None, base
+    return result, max(peak - base, 0), base
+
+
+class MemoryBudgetScheduler(object):
+    """Implements admission of flex files to a process pool so the sum of the estimated peaks of the files
+    being analysed, and the base memory of the worker processes, stays within `memory_budget`. A file whose
+    estimate alone exceeds the budget runs when nothing else is running.
+
+    :param memory_budget: bytes available to analysis across all workers
+    :type memory_budget: int
+    :param workers: maximum number of worker processes, defaults to the number of CPUs
+    :param image_options: list of image options, as for GetStomataObjects
+    :param segment_options: list of segment options, as for GetStomataObjects
+    :param object_filters: list of object filter options, applied in the worker
+    :param compact: return CompactLeafImage results from the workers
+    :param thumbnails: keep cropped images in the CompactLeafImage results
+    :param smoothing: weight of the newest measured/estimated ratio in the running correction factor
+    :type smoothing: float
+    :ivar correction: current factor applied to `estimate_memory`, starts at 1.0
+    :ivar worker_base: base memory reserved for each worker process, the largest measured or `WORKER_BASE_BYTES`
+    :ivar pool_size: number of worker processes of the last run, `workers` capped to the budget with fork
+    :ivar peaks: dict of flex file name: (estimated bytes, measured peak bytes or None)
+
+    """
+
+    def __init__(self, memory_budget, workers=None, image_options=[], segment_options=[], object_filters=[],
+                 compact=False, thumbnails=False, smoothing=0.5):
+        self.memory_budget = memory_budget
+        self.workers = workers or os.cpu_count()
+        self.image_options = image_options
+        self.segment_options = segment_options
+        self.object_filters = object_filters
+        self.compact = compact
+        self.thumbnails = thumbnails
+        self.smoothing = smoothing
+        self.correction = 1.0
+        self.worker_base = WORKER_BASE_BYTES
+        self.pool_size = None
+        self.peaks = {}
+        self._measured_base = False
+
+    def _update_correction(self, estimate, peak):
+        ratio = peak / float(estimate) if estimate else 1.0
+        if not any(measured is not None for _, measured in self.peaks.values()):
+            self.correction = ratio
+        else:
+            self.correction = self.smoothing * ratio + (1 - self.smoothing) * self.correction
+
+    def _update_worker_base(self, base):
+        if not self._measured_base or base > self.worker_base:
+            self.worker_base = base
+            self._measured_base = True
+
+    def as_completed(self, flex_files, projections=None):
+        """generator that analyses the files under the memory budget and yields (index, result) as each finishes,
+        index being the position of the file in `flex_files`
+
+        :param projections: optional list, in the order of `flex_files`, of already computed maximum projections
+            as .npy file names. Each is loaded when its file starts and sent to the worker instead of reading the
+            flex file's pixels
+        """
+        queue = [(i, f, estimate_memory(f, self.image_options, projections is not None)) for i, f in enumerate(flex_files)]
+        running = {}
+        reserved = 0
+        self.pool_size = self.workers
+        started_workers = 0 #the pool keeps a worker once it is started
+        if multiprocessing.get_start_method() == 'fork': #the pool starts every worker on the first submit
+            smallest = min(int(item[2] * self.correction) for item in queue) if queue else 0
+            self.pool_size = max(1, min(self.workers, int((self.memory_budget - smallest) // self.worker_base)))
+            started_workers = self.pool_size
+        with ProcessPoolExecutor(max_workers=self.pool_size) as executor:
+            while queue or running:
+                # first fit: start every queued file that fits, so small files can use cores a large one can't
+                for item in list(queue):
+                    if len(running) >= self.pool_size:
+                        break
+                    need = int(item[2] * self.correction)
+                    workers = max(started_workers, len(running) + 1)
+                    if running and reserved + need + workers * self.worker_base > self.memory_budget:
+                        continue
+                    queue.remove(item)
+                    projection = np.load(projections[item[0]]) if projections is not None else None
+                    future = executor.submit(analyse_flex_file_measured, item[1], self.image_options,
+                                             self.segment_options, self.object_filters, self.compact, self.thumbnails,
+                                             projection)
+                    projection = None
+                    running[future] = (item, need)
+                    reserved += need
+                    started_workers = workers
+
+                done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in done:
+                    (i, flex_file, estimate), need = running.pop(future)
+                    reserved -= need
+                    result, peak, base = future.result()
+                    if base is not None:
+                        self._update_worker_base(base)
+                    if peak is not None:
+                        self._update_correction(estimate, peak)
+                    self.peaks[flex_file] = (estimate, peak)
+                    yield i, result
+
+    def map(self, flex_files, projections=None):
+        """analyses the files under the memory budget
+
+        :param projections: optional list of .npy maximum projection file names, see `as_completed`
+        :return: list -- LeafImage or CompactLeafImage objects in the order of `flex_files`
+        """
+        results = [None] * len(flex_files)
+        for i, result in self.as_completed(flex_files, projections):
+            results[i] = result
+        return results
@@ -0,0 +1,177 @@
+"""Module for passing LeafImage results between processes through shared memory
+
+Pickling a LeafImage copies the full frame `mp`, `stomata_labels` and `binary_obj_img` arrays, plus the label
+image again for every skimage `RegionProperties` it holds. A `SharedLeafImage` instead places the three frames in
+`multiprocessing.shared_memory` blocks and keeps the measurements as a CompactLeafImage, so it pickles to a few
+kilobytes and the receiving process maps the frames without copying them.
+
+Shared memory blocks outlive the processes that use them, so their lifetime is explicit:
+
+* the process that creates a SharedLeafImage owns its blocks and must call `unlink()` (or use it as a context
+  manager) once no process needs the frames any more
+* `handoff=True` hands ownership to whichever process receives the pickled object, which is how workers return
+  results to the parent: the worker keeps no claim on the blocks and the parent must `unlink()` them
+* a process that only receives a SharedLeafImage calls `close()` when done with it, this unmaps the blocks but
+  leaves them for other processes
+
+Before Python 3.13 attaching always registers a block with the resource tracker, which child processes share
+with their parent, so a process attaching without ownership unregisters it again straight away. The tracker then
+no longer holds the block while such a process has it mapped, and only the owner's `unlink()` frees it.
+
+>>> from concurrent.futures import ProcessPoolExecutor
+>>> with ProcessPoolExecutor() as pool:
+...     for shared in pool.map(sd.analyse_flex_file_shared, flex_file_names):
+...         with shared:
+...             sd.stomataobjects.imshow(shared.mp, width=8, height=6)
+
+"""
+
+import os
+import threading
+import numpy as np
+from multiprocessing import shared_memory, resource_tracker
+from .stomataobjects import analyse_flex_file
+
+#: keeps each register/unregister pair sent to the resource tracker together when threads attach at once
+_tracker_lock = threading.Lock()
+
+
+def _untrack(shm):
+    """stop this process's resource tracker from unlinking the block when the process exits"""
+    if os.name == 'posix': #only POSIX blocks are tracked
+        resource_tracker.unregister(shm._name, 'shared_memory')
+
+
+def _attach(name, track):
+    """maps an existing block. Only owners track it, so a leaked block is still freed when its owner exits"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=track)
+    except TypeError: #python < 3.13 always registers attached blocks with the resource tracker
+        with _tracker_lock:
+            shm = shared_memory.SharedMemory(name=name)
+            if not track:
+                _untrack(shm)
+        return shm
+
+
+class SharedArray(object):
+    """A numpy array stored in a `multiprocessing.shared_memory` block. Pickles as the block name, shape and dtype
+    and is mapped again, without copying, when unpickled.
+
+    :ivar array: the numpy.ndarray view of the block, None once closed
+    :ivar owner: True if this handle must unlink the block
+    :ivar handoff: True if ownership passes to the process that unpickles this handle
+
+    """
+
+    def __init__(self, shm, shape, dtype, owner=False, handoff=False):
+        self.shm = shm
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.owner = owner
+        self.handoff = handoff
+        self.array = np.ndarray(self.shape, dtype=self.dtype, buffer=shm.buf)
+
+    @classmethod
+    def from_array(cls, arr, handoff=False):
+        """copies arr into a new shared memory block
+
+        :param arr: the array to share
+        :type arr: numpy.ndarray
+        :param handoff: ownership passes to the process that unpickles the SharedArray, rather than staying here
+        :type handoff: bool
+        :return: SharedArray
+        """
+        arr = np.asarray(arr)
+        shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+        if handoff:
+            _untrack(shm)
+        shared = cls(shm, arr.shape, arr.dtype, owner=not handoff, handoff=handoff)
+        shared.array[...] = arr
+        return shared
+
+    @classmethod
+    def attach(cls, name, shape, dtype, owner=False):
+        """maps an existing block by name, `owner` makes this process responsible for unlinking it"""
+        return cls(_attach(name, owner), shape, dtype, owner)
+
+    def __reduce__(self):
+        return (SharedArray.attach, (self.shm.name, self.shape, self.dtype.str, self.handoff))
+
+    def close(self):
+        """unmaps the block from this process. Fails with BufferError while other views of `array` still exist"""
+        if self.array is not None:
+            self.array = None
+            self.shm.close()
+
+    def unlink(self):
+        """unmaps the block and frees it for every process"""
+        self.close()
+        with _tracker_lock:
+            if os.name == 'posix' and getattr(self.shm, '_track', True):
+                #unlink unregisters the block, which a non-owner sharing the tracker may already have done
+                resource_tracker.register(self.shm._name, 'shared_memory')
+            self.shm.unlink()
+        self.owner = False
+
+
+class SharedLeafImage(object):
+    """A LeafImage whose full frame arrays live in shared memory, see the module documentation for lifetimes.
+
+    `mp`, `stomata_labels` and `binary_obj_img` are the shared arrays; everything else (`stomata_objects`,
+    `sample_info()`, `object_count()` ...) comes from the CompactLeafImage of the original, so it can be used with
+    `custom_report` and `ResultsStore`. Per-object crops are available as views, e.g. `shared.mp[s.position_in_image]`.
+
+    :param leaf_image: the LeafImage to share
+    :param thumbnails: also keep the per-object crops in the CompactLeafImage
+    :param handoff: pass ownership of the blocks to the process that unpickles this object
+    :ivar result: the CompactLeafImage of the original
+    :ivar frames: dict of 'mp', 'stomata_labels', 'binary_obj_img': SharedArray
+
+    """
+
+    FRAMES = ('mp', 'stomata_labels', 'binary_obj_img')
+
+    def __init__(self, leaf_image, thumbnails=False, handoff=False):
+        self.result = leaf_image.compact(thumbnails)
+        self.frames = dict((name, SharedArray.from_array(getattr(leaf_image, name), handoff)) for name in self.FRAMES)
+
+    def __getattr__(self, name):
+        frames = self.__dict__.get('frames')
+        result = self.__dict__.get('result')
+        if frames is None or result is None:
+            raise AttributeError(name)
+        if name in frames:
+            return frames[name].array
+        return getattr(result, name)
+
+    def close(self):
+        """unmaps the frames from this process"""
+        for shared in self.frames.values():
+            shared.close()
+
+    def unlink(self):
+        """unmaps the frames and frees their shared memory"""
+        for shared in self.frames.values():
+            shared.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        """closes the frames, and unlinks them if this process owns them"""
+        for shared in self.frames.values():
+            if shared.owner:
+                shared.unlink()
+            else:
+                shared.close()
+
+
+def analyse_flex_file_shared(flex_file, image_options=[], segment_options=[], object_filters=[], thumbnails=False):
+    """`analyse_flex_file` for worker processes. Returns a SharedLeafImage handed off to the receiving process,
+    which must `unlink()` it (or use it as a context manager)
+
+    :return: SharedLeafImage
+    """
+    leaf_image = analyse_flex_file(flex_file, image_options, segment_options, object_filters)
+    return SharedLeafImage(leaf_image, thumbnails, handoff=True)
@@ -0,0 +1,126 @@
+"""Module for a sparse, per-object representation of a label image
+
+Stomata cover a small fraction of a leaf image, so a full frame label image is mostly zeros. `SparseLabels` keeps
+only a bounding box slice and a boolean mask for each object, with the labels in the smallest unsigned dtype that
+holds them. Dense label and binary images are rebuilt only when asked for, and objects can be deleted, found at
+the image border and measured on the sparse form directly. See `LeafImage.sparsify()`.
+
+"""
+
+import numpy as np
+from scipy import ndimage
+
+
+class SparseLabels(object):
+    """Implements a label image as per-object bounding box masks
+
+    :ivar shape: shape of the dense label image
+    :ivar labels: numpy.ndarray of object labels, in the smallest dtype that holds them
+    :ivar slices: list of the objects' bounding box slices, as from `ndimage.find_objects`
+    :ivar masks: list of boolean numpy.ndarray's, each object's pixels within its bounding box
+
+    """
+
+    def __init__(self, shape, labels, slices, masks):
+        self.shape = tuple(shape)
+        labels = np.asarray(labels, dtype=np.int64)
+        self.labels = labels.astype(np.min_scalar_type(labels.max() if len(labels) else 0))
+        self.slices = list(slices)
+        self.masks = list(masks)
+
+    @classmethod
+    def from_dense(cls, label_image, slices=None):
+        """builds a SparseLabels from a label image
+
+        :param label_image: label image
+        :type label_image: numpy.ndarray
+        :param slices: the objects' slices, in label order, from `ndimage.find_objects` if not given
+        :return: SparseLabels
+        """
+        if slices is None:
+            slices = ndimage.find_objects(label_image)
+        labels = []
+        kept_slices = []
+        masks = []
+        for label, sl in enumerate(slices, start=1):
+            if sl is None:
+                continue
+            mask = label_image[sl] == label
+            if not mask.any(): #deleted from the label image
+                continue
+            labels.append(label)
+            kept_slices.append(sl)
+            masks.append(mask)
+        return cls(label_image.shape, labels, kept_slices, masks)
+
+    def __len__(self):
+        return len(self.labels)
+
+    @property
+    def nbytes(self):
+        return self.labels.nbytes + sum(m.nbytes for m in self.masks)
+
+    def to_dense(self, dtype=None):
+        """returns the dense label image, in the labels' dtype unless `dtype` is given"""
+        dense = np.zeros(self.shape, dtype=dtype or self.labels.dtype)
+        for label, sl, mask in zip(self.labels, self.slices, self.masks):
+            dense[sl][mask] = label
+        return dense
+
+    def downsampled(self, step, dtype=None):
+        """returns the dense label image subsampled by nearest neighbour, equal to `to_dense()[::step, ::step]`
+        but without building the full frame
+
+        :param step: subsampling step along each axis
+        :type step: int
+        """
+        shape = tuple(-(-n // step) for n in self.shape)
+        dense = np.zeros(shape, dtype=dtype or self.labels.dtype)
+        for label, sl, mask in zip(self.labels, self.slices, self.masks):
+            first = [-(-s.start // step) * step for s in sl] #first pixel of the box on the step grid
+            sub = mask[tuple(slice(f - s.start, None, step) for f, s in zip(first, sl))]
+            if sub.size:
+                dense[tuple(slice(f // step, f // step + n) for f, n in zip(first, sub.shape))][sub] = label
+        return dense
+
+    def binary(self):
+        """returns the dense boolean object image"""
+        dense = np.zeros(self.shape, dtype=bool)
+        for sl, mask in zip(self.slices, self.masks):
+            dense[sl] |= mask
+        return dense
+
+    def delete(self, delete_list):
+        """removes the objects with labels in delete_list"""
+        delete_list = set(int(l) for l in delete_list)
+        keep = [i for i, label in enumerate(self.labels) if int(label) not in delete_list]
+        self.labels = self.labels[keep]
+        self.slices = [self.slices[i] for i in keep]
+        self.masks = [self.masks[i] for i in keep]
+
+    def edge_labels(self, margin=3):
+        """labels of objects with pixels within margin pixels of the image edge, as `edge_objects` on the dense image"""
+        rows, cols = self.shape
+        edge = []
+        for label, sl, mask in zip(self.labels, self.slices, self.masks):
+            r0, c0 = sl[0].start, sl[1].start
+            top = margin - r0
+            bottom = rows - margin - r0
+            left = margin - c0
+            right = cols - margin - c0
+            if ((top > 0 and mask[:top].any()) or (bottom < mask.shape[0] and mask[max(bottom, 0):].any()) or
+                    (left > 0 and mask[:, :left].any()) or (right < mask.shape[1] and mask[:, max(right, 0):].any())):
+                edge.append(int(label))
+        return edge
+
+    def areas(self):
+        """returns numpy.ndarray of object areas in pixels, in label order"""
+        return np.array([int(m.sum()) for m in self.masks])
+
+    def centroids(self):
+        """returns (n, 2) numpy.ndarray of object (row, column) centroids, in label order"""
+        centroids = np.zeros((len(self.masks), 2))
+        for i, (sl, mask) in enumerate(zip(self.slices, self.masks)):
+            r, c = np.nonzero(mask)
+            centroids[i] = (r.mean() + sl[0].start, c.mean() + sl[1].start)
+        return centroids
@@ -10,7 +10,14 @@ from skimage.morphology import reconstruction, dilation
 from scipy import ndimage
 from skimage import measure
 import math
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
 from .flexmetadata import *
+from .compactresults import CompactLeafImage, CompactStomataObject
+from .sparselabels import SparseLabels
+from .intensitystats import IntensityHistogram
 
 def max_proj(img_list):
     """ maximum projection from a list of numpy ndarrays
@@ -42,21 +49,52 @@ def maximum_project_flex(flex_file):
     flex = max_proj(flex)
     return rescale(flex)
 
-def imshow(image, title="No Title",cmap='hot', width=36,height=36, **kwargs):
+def imshow(image, title="No Title",cmap='hot', width=None,height=None, max_size=None, overlay=False, dpi=100, **kwargs):
     """render image as a graphic
 
-    :param image: image to show
-    :type image: numpy.ndarray
+    :param image: image to show. If a LeafImage is given its cached preview pyramid is used, so the full
+        resolution maximum projection is not drawn
+    :type image: numpy.ndarray or LeafImage
+    :param max_size: largest number of pixels to draw along either axis, the image is downsampled to fit.
+        Defaults to 1024 for a LeafImage and to full resolution for an array
+    :type max_size: int
+    :param overlay: with a LeafImage, draw the (downsampled) stomata labels over the image
+    :type overlay: bool
+    :param width: figure width in inches, by default one inch per `dpi` pixels of the drawn image
+    :param height: figure height in inches, by default one inch per `dpi` pixels of the drawn image
+    :param dpi: figure resolution
+    :type dpi: int
 
     """
-    fig, ax = plt.subplots(figsize=(width,height))
+    labels = None
+    if isinstance(image, LeafImage):
+        level = image.preview_level(max_size or 1024)
+        if overlay:
+            labels = image.preview_labels(level)
+        image = image.preview(level)
+    elif max_size is not None:
+        step = int(math.ceil(max(image.shape[:2]) / max_size))
+        image = image[::step, ::step]
+    if width is None:
+        width = image.shape[1] / dpi
+    if height is None:
+        height = image.shape[0] / dpi
+    fig, ax = plt.subplots(figsize=(width,height), dpi=dpi)
     ax.imshow(image, cmap=cmap, **kwargs)
+    if labels is not None:
+        ax.imshow(np.ma.masked_equal(labels, 0), cmap='cool', alpha=0.5, interpolation='nearest')
     ax.axis('off')
     ax.set_title(title)
     plt.show()
 
 def imhist(flex,  bins=20, width=36,height=36, **kwargs):
-    plt.hist(flex.mp.ravel(), bins=bins, **kwargs)
+    """plot the intensity histogram of a LeafImage from its precomputed `intensity_histogram`
+
+    :param flex: the LeafImage
+    :param bins: number of bins to plot
+    """
+    counts, values = flex.intensity_histogram()
+    plt.hist(values, bins=bins, weights=counts, **kwargs)
     plt.show()
 
 def is_dark_image(img,min_bright=100, prop=0.1):
@@ -108,8 +146,8 @@ def edge_objects(l, margin=3):
     :return: list
 
     """
-    ls = [l[:, 0:margin].flatten(), l[:, -margin:].flatten(), l[0:margin, :].flatten(), l[-margin:, :].flatten()]
-    return list(set([item for sublist in ls for item in sublist]))
+    ls = [l[:, 0:margin].ravel(), l[:, -margin:].ravel(), l[0:margin, :].ravel(), l[-margin:, :].ravel()]
+    return np.unique(np.concatenate(ls)).tolist()
 
 def long_objects(leaf_image_obj, ratio=3):
     """returns list of objects with self.width_length_ration >= ratio"""
@@ -133,12 +171,14 @@ def delete_objects(leaf_image_obj, delete_list):
     """Given a LeafImageObject and a list of labels, deletes the objects in the labels list from the object list and removes the object from the binary and label image"""
     leaf_image_obj.stomata_objects = [s for s in leaf_image_obj.stomata_objects if not s.label in delete_list]
 
-    for o in delete_list:
-        leaf_image_obj.stomata_labels[leaf_image_obj.stomata_labels == o] = 0
+    if leaf_image_obj.sparse_labels is not None:
+        leaf_image_obj.sparse_labels.delete(delete_list)
+        leaf_image_obj.drop_dense_labels()
+        return
 
-    tmp = np.copy(leaf_image_obj.stomata_labels)
-    tmp[tmp > 0] = 1
-    leaf_image_obj.binary_obj_img = tmp
+    labels = leaf_image_obj.stomata_labels
+    labels[np.isin(labels, list(delete_list))] = 0
+    leaf_image_obj.binary_obj_img = labels > 0
 
 def delete_border_objects(leaf_image_obj,margin=3):
     """Given a LeafImage object, uses border_objects()  attribute to find border objects. uses delete_objects() to delete
@@ -148,7 +188,10 @@ def delete_border_objects(leaf_image_obj,margin=3):
     :type margin: int
 
     """
-    border_obj = edge_objects(leaf_image_obj.stomata_labels,margin)
+    if leaf_image_obj.sparse_labels is not None:
+        border_obj = leaf_image_obj.sparse_labels.edge_labels(margin)
+    else:
+        border_obj = edge_objects(leaf_image_obj.stomata_labels,margin)
     delete_objects(leaf_image_obj, border_obj)
 
 
@@ -213,6 +256,144 @@ def get_stomata(max_proj_image, min_obj_size=200, max_obj_size=1000):
     obj_slices = ndimage.find_objects(stomata)
     return [obj_slices, big_objs, stomata]
 
+def fill_objects(img, dilate=True):
+    """dilates img (optionally) and fills its holes by grayscale reconstruction from the image border, as done in
+    `get_stomata`
+
+    :param img: image
+    :type img: numpy.ndarray
+    :return: numpy.ndarray -- the filled image, objects are its connected non-zero regions
+    """
+    closed = dilation(img) if dilate else img
+    seed = np.copy(closed)
+    seed[1:-1, 1:-1] = closed.max()
+    return reconstruction(seed, closed, method='erosion')
+
+def get_stomata_coarse_to_fine(max_proj_image, min_obj_size=200, max_obj_size=1000, bin_factor=4, pad=8, coarse_slack=4, max_roi_fraction=0.5):
+    """Coarse-to-fine version of `get_stomata` for sparse images. Candidate objects are found on a copy of the
+    image binned by `bin_factor` (block maximum, so faint objects aren't averaged away) and filtered with the
+    minimum size rescaled to the binned pixels and lowered by `coarse_slack`. No maximum size is applied to the
+    candidates, as on speckled backgrounds binning merges stomata and noise into large components. The full
+    resolution dilation, reconstruction, labelling and size filtering is then run only in regions of interest
+    around the candidates, padded by `pad` pixels. Objects touching the edge of a region of interest (but not of
+    the image) are incomplete and are dropped. If the regions of interest cover more than `max_roi_fraction` of
+    the image there is nothing to save and `get_stomata` is run on the whole image instead. Returns the same
+    structure as `get_stomata`; use `validate_coarse_to_fine` to check agreement with it on representative images.
+
+    :param max_proj_image: the maximum projection image
+    :type max_proj_image: numpy.ndarray, uint16
+    :param min_obj_size: minimum size of object to keep, in full resolution pixels
+    :type min_obj_size: int
+    :param max_obj_size: maximum size of object to keep, in full resolution pixels
+    :type max_obj_size: int
+    :param bin_factor: side of the square blocks binned into one pixel of the coarse image
+    :type bin_factor: int
+    :param pad: pixels added around each candidate's bounding box
+    :type pad: int
+    :param coarse_slack: factor the binned minimum size is lowered by
+    :type coarse_slack: float
+    :param max_roi_fraction: fraction of the image the regions of interest may cover before falling back to
+        `get_stomata`
+    :type max_roi_fraction: float
+    :returns: list of [ [coordinates of kept objects - list of slice objects],
+                        binary object image - numpy.ndarray,
+                        labelled object image - numpy.ndarray
+                     ]
+    """
+    binned = measure.block_reduce(max_proj_image, (bin_factor, bin_factor), np.max)
+    # 8-connected, as the full resolution dilation joins diagonal neighbours, so no object spans two candidates
+    coarse_labels, _ = ndimage.label(fill_objects(binned, dilate=False), structure=np.ones((3, 3)))
+    sizes = np.bincount(coarse_labels.ravel())
+    keep = sizes > min_obj_size / bin_factor ** 2 / coarse_slack
+    keep[0] = 0
+
+    # paint padded candidate boxes and merge the overlapping ones into regions of interest
+    rows, cols = max_proj_image.shape
+    roi_mask = np.zeros(max_proj_image.shape, dtype=bool)
+    for label, sl in enumerate(ndimage.find_objects(coarse_labels), start=1):
+        if sl is None or not keep[label]:
+            continue
+        roi_mask[max(sl[0].start * bin_factor - pad, 0):min(sl[0].stop * bin_factor + pad, rows),
+                 max(sl[1].start * bin_factor - pad, 0):min(sl[1].stop * bin_factor + pad, cols)] = True
+    if roi_mask.mean() > max_roi_fraction:
+        return get_stomata(max_proj_image, min_obj_size, max_obj_size)
+    roi_labels, _ = ndimage.label(roi_mask)
+
+    big_objs = np.zeros(max_proj_image.shape, dtype=bool)
+    for roi in ndimage.find_objects(roi_labels):
+        label_objects, nb_labels = ndimage.label(fill_objects(max_proj_image[roi]))
+        sizes = np.bincount(label_objects.ravel())
+        mask_sizes = (sizes > min_obj_size) & (sizes < max_obj_size)
+        mask_sizes[0] = 0
+        cut = []
+        if roi[0].start > 0:
+            cut.append(label_objects[0, :])
+        if roi[0].stop < rows:
+            cut.append(label_objects[-1, :])
+        if roi[1].start > 0:
+            cut.append(label_objects[:, 0])
+        if roi[1].stop < cols:
+            cut.append(label_objects[:, -1])
+        for edge in cut:
+            mask_sizes[edge] = 0
+        big_objs[roi] |= mask_sizes[label_objects]
+
+    stomata, _ = ndimage.label(big_objs)
+    obj_slices = ndimage.find_objects(stomata)
+    return [obj_slices, big_objs, stomata]
+
+def segmentation_agreement(labels, reference_labels, min_iou=0.5):
+    """compares two label images of the same frame, e.g. coarse-to-fine and full resolution `get_stomata` output
+
+    :param labels: label image to test
+    :param reference_labels: reference label image
+    :param min_iou: intersection over union above which two objects are counted as the same object
+    :type min_iou: float
+    :return: dict -- 'dice' pixel-level Dice coefficient of the object masks, 'matched' number of matched objects,
+        'objects' and 'reference_objects' object counts, 'precision', 'recall' and 'f1' of the object matching
+    """
+    a = labels.ravel()
+    b = reference_labels.ravel()
+    fg_a = a > 0
+    fg_b = b > 0
+    total = fg_a.sum() + fg_b.sum()
+    dice = float(2.0 * (fg_a & fg_b).sum() / total) if total else 1.0
+
+    n_a = int(a.max()) + 1
+    n_b = int(b.max()) + 1
+    area_a = np.bincount(a, minlength=n_a)
+    area_b = np.bincount(b, minlength=n_b)
+    both = fg_a & fg_b
+    pairs, intersection = np.unique(a[both].astype(np.int64) * n_b + b[both], return_counts=True)
+    pair_a, pair_b = pairs // n_b, pairs % n_b
+    iou = intersection / (area_a[pair_a] + area_b[pair_b] - intersection)
+    matched = int((iou > min_iou).sum())
+
+    objects = int(np.count_nonzero(area_a[1:]))
+    reference_objects = int(np.count_nonzero(area_b[1:]))
+    precision = matched / objects if objects else 1.0
+    recall = matched / reference_objects if reference_objects else 1.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {'dice': dice, 'matched': matched, 'objects': objects, 'reference_objects': reference_objects,
+            'precision': precision, 'recall': recall, 'f1': f1}
+
+def validate_coarse_to_fine(max_proj_image, min_obj_size=200, max_obj_size=1000, bin_factor=4, pad=8, coarse_slack=4, max_roi_fraction=0.5):
+    """runs `get_stomata` and `get_stomata_coarse_to_fine` on the same image and reports their agreement
+
+    :return: dict -- the `segmentation_agreement` of the coarse-to-fine labels against the full resolution labels,
+        plus 'full_seconds', 'coarse_seconds' and 'speedup'
+    """
+    start = time.perf_counter()
+    full = get_stomata(max_proj_image, min_obj_size, max_obj_size)
+    full_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    coarse = get_stomata_coarse_to_fine(max_proj_image, min_obj_size, max_obj_size, bin_factor, pad, coarse_slack, max_roi_fraction)
+    coarse_seconds = time.perf_counter() - start
+    report = segmentation_agreement(coarse[2], full[2])
+    report.update({'full_seconds': full_seconds, 'coarse_seconds': coarse_seconds,
+                   'speedup': full_seconds / coarse_seconds if coarse_seconds else float('inf')})
+    return report
+
 def get_pore(img, percentile=75,edge_object_margin=1):
     """Extracts largest, non-border, darkest region from subimage - in context presumed to be the pore. Works out the
     values are 0.
@@ -226,24 +407,13 @@ def get_pore(img, percentile=75,edge_object_margin=1):
     """
     dark_level = np.percentile(img, percentile )
     #imshow(img)
-    cp = np.copy(img)
-    cp[img > dark_level] = 0
-    cp[img <= dark_level] = 1
-    label_objects, nb_labels = ndimage.label(cp)
-    removed = np.copy(label_objects)
-    for o in edge_objects(label_objects, margin=edge_object_margin):
-        removed[removed == o] = 0
+    label_objects, nb_labels = ndimage.label(img <= dark_level)
+    removed = label_objects * ~np.isin(label_objects, edge_objects(label_objects, margin=edge_object_margin))
     new_label_objects, new_nb_labels = ndimage.label(removed)
-    props = measure.regionprops(new_label_objects, intensity_image=img)
-    if len(props) > 0:
-        area = max([i.area for i in props])
-        biggest = [i for i, j in enumerate(props) if j.area == area]
-
-        index_of_obj_to_keep = biggest[0]
-        label_of_obj_to_keep = np.arange(1, new_nb_labels + 1)[index_of_obj_to_keep]
-        new_label_objects[new_label_objects != label_of_obj_to_keep] = 0
-        final_label_objects, final_nb_labels = ndimage.label(new_label_objects)
-        return(final_label_objects)
+    if new_nb_labels > 0:
+        areas = np.bincount(new_label_objects.ravel())
+        label_of_obj_to_keep = np.argmax(areas[1:]) + 1 #first of the largest, in label order
+        return (new_label_objects == label_of_obj_to_keep).astype(new_label_objects.dtype)
     else: #no pore
         return(None)
 
@@ -286,27 +456,102 @@ def custom_report(flex, stomata):
     props = [str(x) for x in flex.sample_info()] + [str(flex.object_count()) ] + [str(x) for x in stomata.stoma_info() ]
     return ",".join(props)
 
+def analyse_flex_file(flex_file, image_options=[], segment_options=[], object_filters=[], compact=False, thumbnails=False, projection=None):
+    """Runs the whole analysis of one flex file: builds the LeafImage, applies `object_filters` and optionally
+    reduces it to a CompactLeafImage. Is a module level function so it can be sent to worker processes.
+
+    :param flex_file: the flex file to analyse
+    :param image_options: list of image options or a Qopts object
+    :param segment_options: list of segment options or a Qopts object
+    :param object_filters: list of object filter options, see `object_filter`
+    :param compact: return a CompactLeafImage
+    :type compact: bool
+    :param thumbnails: keep cropped images in the CompactLeafImage
+    :type thumbnails: bool
+    :param projection: an already computed maximum projection of the file, see LeafImage
+    :return: LeafImage or CompactLeafImage
+    """
+    if not isinstance(image_options, Qopts):
+        image_options = Qopts(image_options)
+    if not isinstance(segment_options, Qopts):
+        segment_options = Qopts(segment_options)
+    leaf_image = LeafImage(flex_file, image_options = image_options, segment_options = segment_options, projection = projection )
+    object_filter(leaf_image, object_filters)
+    if compact:
+        return leaf_image.compact(thumbnails)
+    return leaf_image
+
 class GetStomataObjects(object):
     """Gets list of LeafImage objects from a list of flex file names. Each file name provided returns a
     different LeafImage object. Each LeafImage object has an attribute `stomata_objects` that contains stomata information
 
     >>> analysed_flex_files = sd.GetStomataObjects(flex_file_names, image_options=[], segment_options = [] )
 
+    With `compact=True` each LeafImage is filtered with `object_filters` and then reduced to a CompactLeafImage,
+    keeping only the measurements (and cropped thumbnails if `thumbnails=True`)
+
+    >>> analysed_flex_files = sd.GetStomataObjects(flex_file_names, image_options=[], segment_options = [], object_filters=obj_filter, compact=True )
+
+    With `memory_budget` (bytes) the files are analysed in up to `workers` processes by a MemoryBudgetScheduler,
+    results keep the order of `flex_file_name_list`
+
+    The image option ('clip', 'auto') sets the clip range from the plate: every file is read and projected once,
+    in this process, the projections' IntensityHistograms are merged into `histogram` and the
+    ('clip_percentiles', (low, high)) image option percentiles of it (default (1, 99.5)) become the clip range,
+    stored in `clip_range`. The projections are kept in a temporary directory, not in memory, which takes one
+    frame of disk per file (8 MB for a 2048 x 2048 uint16 frame), and the files are then analysed from them,
+    under `memory_budget` if given. The percentiles are of the raw projections, so put ('clip', 'auto') before
+    other image options
+
     """
 
-    def __init__(self, flex_file_name_list, image_options=[], segment_options = [] ):
+    def __init__(self, flex_file_name_list, image_options=[], segment_options = [], object_filters=[], compact=False, thumbnails=False, memory_budget=None, workers=None ):
 
 
         self.flex_files = flex_file_name_list
         self.image_opts = Qopts(image_options)
         self.segment_opts = Qopts(segment_options)
+        self.object_filters = object_filters
+        self.compact = compact
+        self.thumbnails = thumbnails
+        self.memory_budget = memory_budget
+        self.workers = workers
+        self.histogram = None
+        self.clip_range = None
 
 
 
         self.processed_images = self.process_images()
 
     def process_images(self):
-        return [LeafImage(flex_file, image_options = self.image_opts, segment_options = self.segment_opts ) for flex_file in self.flex_files]
+        if getattr(self.image_opts, 'clip', None) == 'auto':
+            return self.process_images_auto_clip()
+        if self.memory_budget is not None:
+            from .scheduler import MemoryBudgetScheduler
+            scheduler = MemoryBudgetScheduler(self.memory_budget, self.workers, self.image_opts, self.segment_opts, self.object_filters, self.compact, self.thumbnails)
+            return scheduler.map(self.flex_files)
+        return [self.process_image(flex_file) for flex_file in self.flex_files]
+
+    def process_images_auto_clip(self):
+        self.histogram = IntensityHistogram()
+        with tempfile.TemporaryDirectory() as projection_dir:
+            projections = []
+            for i, flex_file in enumerate(self.flex_files):
+                mp = maximum_project_flex(flex_file)
+                self.histogram.update(mp)
+                projections.append(os.path.join(projection_dir, '{}.npy'.format(i)))
+                np.save(projections[-1], mp)
+            self.clip_range = self.histogram.clip_range(*getattr(self.image_opts, 'clip_percentiles', (1, 99.5)))
+            self.image_opts.clip = self.clip_range
+            if self.memory_budget is not None:
+                from .scheduler import MemoryBudgetScheduler
+                scheduler = MemoryBudgetScheduler(self.memory_budget, self.workers, self.image_opts, self.segment_opts, self.object_filters, self.compact, self.thumbnails)
+                return scheduler.map(self.flex_files, projections)
+            return [analyse_flex_file(flex_file, self.image_opts, self.segment_opts, self.object_filters, self.compact, self.thumbnails, np.load(projection))
+                    for flex_file, projection in zip(self.flex_files, projections)]
+
+    def process_image(self, flex_file):
+        return analyse_flex_file(flex_file, self.image_opts, self.segment_opts, self.object_filters, self.compact, self.thumbnails)
 
     def __iter__(self):
         return iter(self.processed_images)
@@ -323,14 +568,31 @@ class LeafImage(object):
     :ivar binary_obj_img: a binary image of the objects
     :ivar stomata_labels: a numpy label image of the stomata found
     :ivar stomata_objects: list of StomataObject's - one per detected stomate
+
+    If `projection` is given it is used as the maximum projection and the pixel data of `flex_file` isn't read.
+
+    After `sparsify()` the objects are held as a SparseLabels in `sparse_labels` and `stomata_labels` and
+    `binary_obj_img` are rebuilt from it only when accessed.
+
+    The segment option ('coarse_bin', n) segments with `get_stomata_coarse_to_fine` on an n x n binned copy of the
+    projection, ('coarse_pad', p) sets its region of interest padding and ('coarse_max_roi', f) the fraction of the
+    image the regions may cover before it falls back to full resolution `get_stomata`.
+
+    The segment option ('threads', n) builds the StomataObject's, including pore extraction, on a pool of n
+    threads. Objects are returned in label order whatever the thread count. Only this per-object phase is threaded;
+    use worker processes (`memory_budget`, WatchFolder) to parallelise batches.
     """
 
-    def __init__(self, flex_file, image_options=[], segment_options = [] ):
+    sparse_labels = None
+    _stomata_labels = None
+    _binary_obj_img = None
+
+    def __init__(self, flex_file, image_options=[], segment_options = [], projection=None ):
 
         #if len(image_options) == 0:
         #    image_options = [('clip', (50,100))]
         self.flex_file = flex_file
-        self.mp = maximum_project_flex(self.flex_file)
+        self.mp = maximum_project_flex(self.flex_file) if projection is None else projection
         self.stomata_positions = []
         self.binary_obj_img = np.zeros((10,10))
         self.stomata_labels = np.zeros((10,10))
@@ -338,11 +600,14 @@ class LeafImage(object):
         self.metadata = None
         self.treatment = None
         self.well_coordinate = None
+        self.plate_row = None
+        self.plate_column = None
         self.imaging_time = None
         self.x_units = None
         self.y_units = None
         self.x_perpixel = None
         self.y_perpixel = None
+        self.stack = None
         self.camerabinning_x = None
         self.camerabinning_y = None
 
@@ -381,12 +646,26 @@ class LeafImage(object):
 
         self.is_dark = is_dark_image(self.mp)
 
-        stomata_data = get_stomata(self.mp, min_obj_size=segment_options.stomate_min_obj_size, max_obj_size=segment_options.stomate_max_obj_size)
+        coarse_bin = getattr(segment_options, 'coarse_bin', None)
+        if coarse_bin:
+            stomata_data = get_stomata_coarse_to_fine(self.mp, min_obj_size=segment_options.stomate_min_obj_size, max_obj_size=segment_options.stomate_max_obj_size, bin_factor=coarse_bin, pad=getattr(segment_options, 'coarse_pad', 8), max_roi_fraction=getattr(segment_options, 'coarse_max_roi', 0.5))
+        else:
+            stomata_data = get_stomata(self.mp, min_obj_size=segment_options.stomate_min_obj_size, max_obj_size=segment_options.stomate_max_obj_size)
         self.stomata_positions = stomata_data[0]
         self.binary_obj_img = stomata_data[1]
         self.stomata_labels = stomata_data[2]
         stomata_props = measure.regionprops(self.stomata_labels, intensity_image=self.mp)
-        self.stomata_objects = [StomataObject(self.mp[stomata_pos[0]], stomata_pos[0], stomata_pos[1], self.binary_obj_img, stomata_pos[2], segment_options ) for stomata_pos in zip(self.stomata_positions, stomata_props, range(1, self.stomata_labels.max() + 1) )]
+        stomata_pos_list = zip(self.stomata_positions, stomata_props, range(1, self.stomata_labels.max() + 1) )
+
+        def make_stomata_object(stomata_pos):
+            return StomataObject(self.mp[stomata_pos[0]], stomata_pos[0], stomata_pos[1], self.binary_obj_img, stomata_pos[2], segment_options )
+
+        threads = getattr(segment_options, 'threads', 1)
+        if threads > 1:
+            with ThreadPoolExecutor(max_workers=threads) as executor:
+                self.stomata_objects = list(executor.map(make_stomata_object, stomata_pos_list))
+        else:
+            self.stomata_objects = [make_stomata_object(stomata_pos) for stomata_pos in stomata_pos_list]
 
     def object_count(self):
         return len(self.stomata_objects)
@@ -394,6 +673,100 @@ class LeafImage(object):
     def sample_info(self):
         return [self.treatment, self.plate_row, self.plate_column,  self.imaging_time, self.x_units, self.x_perpixel, self.y_units, self.y_perpixel, self.stack, self.camerabinning_x, self.camerabinning_y]
 
+    @property
+    def stomata_labels(self):
+        if self._stomata_labels is None and self.sparse_labels is not None:
+            self._stomata_labels = self.sparse_labels.to_dense()
+        return self._stomata_labels
+
+    @stomata_labels.setter
+    def stomata_labels(self, value):
+        self._stomata_labels = value
+
+    @property
+    def binary_obj_img(self):
+        if self._binary_obj_img is None and self.sparse_labels is not None:
+            self._binary_obj_img = self.sparse_labels.binary()
+        return self._binary_obj_img
+
+    @binary_obj_img.setter
+    def binary_obj_img(self, value):
+        self._binary_obj_img = value
+
+    def sparsify(self):
+        """replaces the full frame `stomata_labels` and `binary_obj_img` with a SparseLabels of per-object masks in
+        `sparse_labels`, and the StomataObject's with CompactStomataObject's (with thumbnails), whose skimage
+        properties would otherwise keep the dense label image alive. The dense images are rebuilt, and cached, when
+        next accessed; call `drop_dense_labels()` to release them again. Object filters work on the sparse form.
+        """
+        if self.sparse_labels is None:
+            self.sparse_labels = SparseLabels.from_dense(self.stomata_labels, self.stomata_positions)
+        self.stomata_objects = [s if isinstance(s, CompactStomataObject) else CompactStomataObject(s, thumbnails=True) for s in self.stomata_objects]
+        self.drop_dense_labels()
+
+    def drop_dense_labels(self):
+        """releases the dense label and binary images rebuilt from `sparse_labels`"""
+        if self.sparse_labels is not None:
+            self._stomata_labels = None
+            self._binary_obj_img = None
+
+    def preview(self, level=0):
+        """returns the maximum projection downsampled by 2 ** level. Levels are built on first use by 2x2 block
+        averaging of the level above and cached, so call again after changing `mp`
+
+        :param level: the pyramid level, 0 is full resolution
+        :type level: int
+        :return: numpy.ndarray
+        """
+        if getattr(self, '_preview_pyramid', None) is None or self._preview_pyramid[0] is not self.mp:
+            self._preview_pyramid = [self.mp]
+        while len(self._preview_pyramid) <= level:
+            above = self._preview_pyramid[-1]
+            below = measure.block_reduce(above, (2, 2), np.mean)
+            self._preview_pyramid.append(below.astype(self.mp.dtype))
+        return self._preview_pyramid[level]
+
+    def preview_level(self, max_size=1024):
+        """returns the smallest pyramid level whose largest side is at most max_size pixels"""
+        level = 0
+        while max(self.mp.shape) > max_size * 2 ** level:
+            level += 1
+        return level
+
+    def preview_labels(self, level=0):
+        """returns `stomata_labels` downsampled to match `preview(level)`, by nearest neighbour so labels are kept.
+        A sparsified image is painted from `sparse_labels` without rebuilding the full frame labels"""
+        step = 2 ** level
+        if self.sparse_labels is not None:
+            self.drop_dense_labels()
+            return self.sparse_labels.downsampled(step)
+        return self.stomata_labels[::step, ::step]
+
+    def intensity_histogram(self):
+        """returns the histogram of `mp`, computed once and cached. uint8 and uint16 images are counted per value
+        with an IntensityHistogram, others in 256 bins
+
+        :return: tuple -- (counts, values) numpy.ndarray's, values are the pixel value or bin centre of each count
+        """
+        if getattr(self, '_histogram', None) is None or self._histogram[0] is not self.mp:
+            if self.mp.dtype.kind == 'u' and self.mp.dtype.itemsize <= 2:
+                counts = IntensityHistogram.from_image(self.mp).counts[:int(self.mp.max()) + 1]
+                values = np.arange(len(counts))
+            else:
+                counts, edges = np.histogram(self.mp, bins=256)
+                values = (edges[:-1] + edges[1:]) / 2
+            self._histogram = (self.mp, counts, values)
+        return self._histogram[1], self._histogram[2]
+
+    def compact(self, thumbnails=False):
+        """returns a CompactLeafImage holding only the measurements and slices of this image, dropping the
+        full-frame arrays and metadata
+
+        :param thumbnails: keep the cropped intensity, stomate and pore images of each object
+        :type thumbnails: bool
+        :return: CompactLeafImage
+        """
+        return CompactLeafImage(self, thumbnails)
 
 
 
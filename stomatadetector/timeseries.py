@@ -0,0 +1,146 @@
+"""Module for following stomata in the same well across time points
+
+Results are indexed by well (`plate_row`, `plate_column`) and `imaging_time`. When a time point is added its
+stomata are linked to those of the previous time point of the same well by nearest centroid, using a KD-tree of
+the previous centroids, so only the new time point is processed. Linked stomata share a track id, and the
+trajectory of each track, e.g. pore width over time, can be read directly.
+
+Time points can be added in any order, as they come from `WatchFolder.watch()` or `analyse_flex_files_async`.
+A late time point is inserted between its neighbours, linked to both, and the track ids of the later time points
+of its well are updated from the new links.
+
+>>> tracker = sd.TimeSeriesTracker(max_distance=10)
+>>> for flex in sd.GetStomataObjects(flex_file_names, image_options, segment_options, compact=True):
+...     tracker.add(flex)
+>>> tracker.trajectories(2, 4)
+
+"""
+
+import bisect
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+def _centroid(stomata_object):
+    centroid = getattr(stomata_object, 'centroid', None)
+    if centroid is None:
+        centroid = stomata_object.props.centroid
+    return tuple(float(c) for c in centroid)
+
+
+def _float_or_none(value):
+    return None if value is None or value == 'None' else float(value)
+
+
+class TimeSeriesTracker(object):
+    """Implements incremental, per-well linking of stomata across time points
+
+    :param max_distance: largest centroid movement, in pixels, between consecutive time points for two stomata
+        to be linked
+    :type max_distance: float
+    :ivar wells: dict of (plate_row, plate_column): list of time point dicts in time order, each with 'time',
+        'flex_file', 'centroids' (n x 2 numpy.ndarray), 'stoma_info' (list), 'parents' (numpy.ndarray, index of
+        the linked stomate in the previous time point, -1 if none) and 'track_ids' (numpy.ndarray)
+
+    """
+
+    def __init__(self, max_distance=10):
+        self.max_distance = max_distance
+        self.wells = {}
+        self._next_track = {}
+
+    def add(self, leaf_image):
+        """links the stomata of a LeafImage or CompactLeafImage to the previous time point of its well, and the
+        next time point's stomata to it if it arrived late
+
+        :return: numpy.ndarray -- the track id of each stomate, in `stomata_objects` order
+        """
+        well = (int(leaf_image.plate_row), int(leaf_image.plate_column))
+        time = leaf_image.imaging_time
+        series = self.wells.setdefault(well, [])
+        times = [t['time'] for t in series]
+        position = bisect.bisect(times, time)
+        if position and times[position - 1] == time:
+            raise ValueError("well {} already has time point {}".format(well, time))
+
+        centroids = np.array([_centroid(s) for s in leaf_image.stomata_objects], dtype=float).reshape(-1, 2)
+        point = {'time': time, 'flex_file': leaf_image.flex_file, 'centroids': centroids,
+                 'stoma_info': [s.stoma_info() for s in leaf_image.stomata_objects],
+                 'parents': self._link(series[position - 1] if position else None, centroids),
+                 'track_ids': np.full(len(centroids), -1, dtype=np.int64)}
+        series.insert(position, point)
+        if position + 1 < len(series):
+            following = series[position + 1]
+            following['parents'] = self._link(point, following['centroids'])
+        self._assign_tracks(well, series, position)
+        return point['track_ids']
+
+    def _link(self, previous, centroids):
+        """returns the index of the matched stomate of `previous` for each centroid, -1 where there is none"""
+        parents = np.full(len(centroids), -1, dtype=np.int64)
+        if previous is not None and len(previous['centroids']) and len(centroids):
+            for i, j in self._match(previous['centroids'], centroids):
+                parents[j] = i
+        return parents
+
+    def _assign_tracks(self, well, series, start):
+        """sets the track ids of the time points from `start` on: linked stomata take the id of their parent, the
+        others keep their own id unless an earlier time point already uses it, when they get a new one"""
+        next_track = self._next_track.get(well, 0)
+        earlier = None
+        for k in range(start, len(series)):
+            t = series[k]
+            for j, parent in enumerate(t['parents']):
+                if parent >= 0:
+                    t['track_ids'][j] = series[k - 1]['track_ids'][parent]
+                    continue
+                if t['track_ids'][j] >= 0:
+                    if earlier is None: #only needed after a late time point
+                        earlier = set(int(i) for p in series[:k] for i in p['track_ids'])
+                    if int(t['track_ids'][j]) not in earlier:
+                        continue
+                t['track_ids'][j] = next_track
+                next_track += 1
+            if earlier is not None:
+                earlier.update(int(i) for i in t['track_ids'])
+        self._next_track[well] = next_track
+
+    def _match(self, previous, current):
+        """one-to-one nearest centroid matching, closest pairs first, returns list of (previous, current) indices"""
+        k = min(3, len(previous))
+        distances, neighbours = cKDTree(previous).query(current, k=k, distance_upper_bound=self.max_distance)
+        distances = distances.reshape(len(current), k)
+        neighbours = neighbours.reshape(len(current), k)
+        candidates = sorted((d, i, j) for j in range(len(current)) for d, i in zip(distances[j], neighbours[j]) if np.isfinite(d))
+        used_previous = set()
+        used_current = set()
+        pairs = []
+        for d, i, j in candidates:
+            if i in used_previous or j in used_current:
+                continue
+            used_previous.add(i)
+            used_current.add(j)
+            pairs.append((int(i), j))
+        return pairs
+
+    def times(self, plate_row, plate_column):
+        """returns the imaging times of a well, in order"""
+        return [t['time'] for t in self.wells.get((int(plate_row), int(plate_column)), [])]
+
+    def trajectory(self, plate_row, plate_column, track_id):
+        """returns the measurements of one tracked stomate over time
+
+        :return: list of dicts of 'time', 'centroid', 'area', 'pore_length', 'pore_width', one per time point the
+            stomate was found in
+        """
+        return self.trajectories(plate_row, plate_column, min_length=1).get(int(track_id), [])
+
+    def trajectories(self, plate_row, plate_column, min_length=2):
+        """returns dict of track id: `trajectory` for every track of a well seen in at least `min_length` time points"""
+        tracks = {}
+        for t in self.wells.get((int(plate_row), int(plate_column)), []):
+            for track_id, centroid, info in zip(t['track_ids'], t['centroids'], t['stoma_info']):
+                tracks.setdefault(int(track_id), []).append(
+                    {'time': t['time'], 'centroid': tuple(float(c) for c in centroid), 'area': float(info[1]),
+                     'pore_length': _float_or_none(info[5]), 'pore_width': _float_or_none(info[6])})
+        return dict((i, track) for i, track in tracks.items() if len(track) >= min_length)
@@ -0,0 +1,183 @@
+"""Module for analysing .flex files as the microscope writes them into a folder
+
+A file is only analysed once it is fully written, i.e. its size and modification time have not changed for
+`stable_polls * poll_interval` seconds, however often the folder is polled. Stable files are analysed in a pool
+of worker processes and a running plate report is kept as results come back. A file that fails to analyse is
+analysed again if its size or modification time changes afterwards, e.g. when the microscope had only paused
+writing it.
+
+>>> watcher = sd.WatchFolder(f.path, image_options=image_options, segment_options=segment_options, expected_files=96)
+>>> for flex in watcher.watch():
+...     print(flex.flex_file, flex.object_count())
+>>> print("\\n".join(watcher.report()))
+
+"""
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from .filebrowser import GetFlexList
+from .stomataobjects import analyse_flex_file, report_header, custom_report
+
+
+class WatchFolder(object):
+    """Implements polling of a folder for new, fully written .flex files and their analysis in worker processes
+
+    :param path: the folder to watch
+    :param image_options: list of image options, as for GetStomataObjects
+    :param segment_options: list of segment options, as for GetStomataObjects
+    :param object_filters: list of object filter options, applied in the worker before results are returned
+    :param workers: number of worker processes, defaults to the number of CPUs
+    :param stable_polls: number of poll intervals a file's size and mtime must be unchanged before it is analysed
+    :param poll_interval: seconds between polls
+    :param expected_files: stop watching once this many files have been analysed, None to watch until `idle_timeout`.
+        A failed file counts once it has stayed unchanged for `stable_polls * poll_interval` seconds after failing
+    :param idle_timeout: stop watching after this many seconds with no new files and no work in progress
+    :param store: an optional ResultsStore that every result is added to
+    :param compact: return CompactLeafImage results from the workers, which are much cheaper to send back
+    :ivar results: dict of flex file name: analysed LeafImage or CompactLeafImage
+    :ivar errors: dict of flex file name: exception raised while analysing it, removed if the file is retried
+
+    """
+
+    def __init__(self, path, image_options=[], segment_options=[], object_filters=[], workers=None, stable_polls=2,
+                 poll_interval=10, expected_files=None, idle_timeout=600, store=None, compact=True):
+        self.path = path
+        self.image_options = image_options
+        self.segment_options = segment_options
+        self.object_filters = object_filters
+        self.workers = workers
+        self.stable_polls = stable_polls
+        self.poll_interval = poll_interval
+        self.expected_files = expected_files
+        self.idle_timeout = idle_timeout
+        self.store = store
+        self.compact = compact
+        self.results = {}
+        self.errors = {}
+        self._seen = {}
+        self._submitted = {}
+        self._unsettled = {}
+        self._pending = {}
+        self._executor = None
+
+    def poll(self):
+        """checks the folder once and returns the list of files that became stable since the last poll
+
+        :return: list -- flex file names that are fully written and haven't been analysed yet
+        """
+        now = time.time()
+        stable_seconds = self.stable_polls * self.poll_interval
+        stable = []
+        for flex_file in GetFlexList(self.path):
+            if flex_file in self._submitted and flex_file not in self.errors:
+                continue
+            try:
+                stat = os.stat(flex_file)
+            except OSError: #removed or renamed since listing
+                continue
+            signature = (stat.st_size, stat.st_mtime)
+            if flex_file in self.errors:
+                if signature == self._submitted[flex_file]:
+                    if flex_file in self._unsettled and now - self._unsettled[flex_file] >= stable_seconds:
+                        del self._unsettled[flex_file]
+                    continue
+                #changed since it failed, analyse again once stable
+                del self.errors[flex_file]
+                del self._submitted[flex_file]
+                self._unsettled.pop(flex_file, None)
+            last_signature, since = self._seen.get(flex_file, (None, now))
+            if signature != last_signature:
+                since = now
+            self._seen[flex_file] = (signature, since)
+            if now - since >= stable_seconds and stat.st_size > 0:
+                stable.append(flex_file)
+        return sorted(stable)
+
+    def submit(self, flex_file):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        future = self._executor.submit(analyse_flex_file, flex_file, self.image_options, self.segment_options,
+                                       self.object_filters, self.compact)
+        self._pending[future] = flex_file
+        self._submitted[flex_file] = self._seen.get(flex_file, (None,))[0]
+
+    def collect(self, timeout=0):
+        """returns the results of files that finished analysing, waiting up to `timeout` seconds for the first one
+
+        :return: list -- analysed LeafImage or CompactLeafImage objects
+        """
+        if not self._pending:
+            return []
+        done, _ = wait(list(self._pending), timeout=timeout, return_when=FIRST_COMPLETED)
+        finished = []
+        for future in done:
+            flex_file = self._pending.pop(future)
+            try:
+                result = future.result()
+            except Exception as e:
+                self.errors[flex_file] = e
+                self._unsettled[flex_file] = time.time()
+                continue
+            self.results[flex_file] = result
+            if self.store is not None:
+                self.store.add(result)
+            finished.append(result)
+        return finished
+
+    def is_finished(self):
+        settled_errors = len(self.errors) - len(self._unsettled)
+        return self.expected_files is not None and len(self.results) + settled_errors >= self.expected_files
+
+    def watch(self):
+        """generator that polls the folder, analyses stable files and yields results as they complete.
+        Stops when `expected_files` are done or after `idle_timeout` seconds without new files or pending work
+        """
+        last_activity = time.time()
+        try:
+            while not self.is_finished():
+                for flex_file in self.poll():
+                    self.submit(flex_file)
+                    last_activity = time.time()
+                for result in self.collect(timeout=self.poll_interval if self._pending else 0):
+                    last_activity = time.time()
+                    yield result
+                if self.is_finished():
+                    break
+                if not self._pending:
+                    if time.time() - last_activity > self.idle_timeout:
+                        break
+                    time.sleep(self.poll_interval)
+        finally:
+            self.close()
+
+    def run(self):
+        """watches the folder until it is finished and returns all results, in file name order
+
+        :return: list -- analysed LeafImage or CompactLeafImage objects
+        """
+        for _ in self.watch():
+            pass
+        return [self.results[f] for f in sorted(self.results)]
+
+    def report(self):
+        """returns the running plate report as a list of lines, header first, in file name order"""
+        lines = [report_header()]
+        for flex_file in sorted(self.results):
+            flex = self.results[flex_file]
+            lines += [custom_report(flex, s) for s in flex.stomata_objects]
+        return lines
+
+    def close(self):
+        for future in self._pending:
+            future.cancel()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self._pending = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,159 @@
+"""Tests for analyse_flex_files_async on a locally simulated stream of incoming files, with the analysis replaced
+by a fast stand-in and the worker processes by threads"""
+
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from stomatadetector import asyncanalysis
+
+
+class FakeResult(object):
+    def __init__(self, flex_file):
+        self.flex_file = flex_file
+
+
+class RecordingExecutor(ThreadPoolExecutor):
+    """ThreadPoolExecutor that records whether it was shut down"""
+
+    def __init__(self, *args, **kwargs):
+        super(RecordingExecutor, self).__init__(max_workers=4)
+        self.was_shutdown = False
+
+    def shutdown(self, *args, **kwargs):
+        self.was_shutdown = True
+        super(RecordingExecutor, self).shutdown(*args, **kwargs)
+
+
+@pytest.fixture
+def fake_analysis(monkeypatch):
+    """replaces analyse_flex_file with a stand-in that waits for `gate` and records the files it started"""
+    state = {'gate': threading.Event(), 'started': [], 'executors': []}
+
+    def analyse(flex_file, **kwargs):
+        state['started'].append(flex_file)
+        state['gate'].wait(5)
+        return FakeResult(flex_file)
+
+    def make_executor(*args, **kwargs):
+        executor = RecordingExecutor()
+        state['executors'].append(executor)
+        return executor
+
+    monkeypatch.setattr(asyncanalysis, 'analyse_flex_file', analyse)
+    monkeypatch.setattr(asyncanalysis, 'ProcessPoolExecutor', make_executor)
+    yield state
+    state['gate'].set()
+
+
+async def produce(queue, flex_files, delay=0.001):
+    for flex_file in flex_files:
+        await asyncio.sleep(delay)
+        await queue.put(flex_file)
+    await queue.put(None)
+
+
+def test_queue_source_delivers_every_result(fake_analysis):
+    fake_analysis['gate'].set()
+    flex_files = ['{}.flex'.format(i) for i in range(20)]
+
+    async def run():
+        queue = asyncio.Queue()
+        producer = asyncio.ensure_future(produce(queue, flex_files))
+        results = [r async for r in asyncanalysis.analyse_flex_files_async(asyncanalysis.queue_source(queue), max_pending=3)]
+        await producer
+        return results
+
+    results = asyncio.run(run())
+    assert sorted(r.flex_file for r in results) == sorted(flex_files)
+    assert fake_analysis['executors'][0].was_shutdown
+
+
+def test_gather_keeps_input_order(fake_analysis):
+    fake_analysis['gate'].set()
+    flex_files = ['{}.flex'.format(i) for i in range(10)]
+    with ThreadPoolExecutor(4) as executor:
+        results = asyncio.run(asyncanalysis.AsyncStomataObjects(flex_files, executor=executor).gather())
+    assert [r.flex_file for r in results] == flex_files
+
+
+def test_max_pending_holds_back_submission(fake_analysis):
+    flex_files = ['{}.flex'.format(i) for i in range(10)]
+
+    async def run():
+        results = []
+
+        async def consume():
+            async for r in asyncanalysis.analyse_flex_files_async(flex_files, max_pending=2):
+                results.append(r)
+
+        consumer = asyncio.ensure_future(consume())
+        await asyncio.sleep(0.2)
+        started = len(fake_analysis['started'])
+        fake_analysis['gate'].set()
+        await consumer
+        return started, results
+
+    started, results = asyncio.run(run())
+    assert started == 2
+    assert len(results) == len(flex_files)
+
+
+def wait_for_threads(executor):
+    executor.shutdown(wait=True)
+
+
+def test_cancelling_the_consumer_releases_the_executor(fake_analysis):
+    flex_files = ['{}.flex'.format(i) for i in range(10)]
+
+    async def run():
+        async def consume():
+            async for _ in asyncanalysis.analyse_flex_files_async(flex_files, max_pending=6):
+                pass
+
+        consumer = asyncio.ensure_future(consume())
+        await asyncio.sleep(0.1)
+        consumer.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await consumer
+
+    asyncio.run(run())
+    fake_analysis['gate'].set()
+    executor = fake_analysis['executors'][0]
+    assert executor.was_shutdown
+    wait_for_threads(executor)
+    assert len(fake_analysis['started']) == 4 #the 2 files not yet started were cancelled
+
+
+def test_leaving_async_for_early_releases_the_executor(fake_analysis):
+    fake_analysis['gate'].set()
+    flex_files = ['{}.flex'.format(i) for i in range(10)]
+
+    async def run():
+        async for _ in asyncanalysis.analyse_flex_files_async(flex_files, max_pending=2):
+            break
+        for _ in range(10): #let the event loop finalise the abandoned generator
+            await asyncio.sleep(0)
+
+    asyncio.run(run())
+    assert fake_analysis['executors'][0].was_shutdown
+
+
+def test_failing_source_releases_the_executor(fake_analysis):
+    fake_analysis['gate'].set()
+
+    async def source():
+        yield 'a.flex'
+        yield 'b.flex'
+        raise RuntimeError('producer failed')
+
+    async def run():
+        async for _ in asyncanalysis.analyse_flex_files_async(source()):
+            pass
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(run())
+    assert fake_analysis['executors'][0].was_shutdown